@@ -3,10 +3,11 @@ import argparse
 from typing import List, Dict, Any
 from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from litellm import completion
 import pandas as pd
 import os
 from src.types import Task
+from src.checkpoint import load_checkpoint
+from src import llm
 
 
 load_dotenv()
@@ -68,6 +69,9 @@ def get_args() -> argparse.Namespace:
     parser.add_argument("--output_path", type=str, required=True, help="Path to the output file")
     parser.add_argument("--max_num_failed_results", "-n", type=int, default=None,
                         help="Maximum number of failed results to analyze")
+    parser.add_argument("--rpm", type=float, default=None, help="Requests per minute allowed for the judge model")
+    parser.add_argument("--tpm", type=float, default=None, help="Tokens per minute allowed for the judge model")
+    parser.add_argument("--llm_cache", type=str, default=None, help="SQLite file caching judge responses (off by default)")
     return parser.parse_args()
 
 def display_conversation(messages):
@@ -101,13 +105,17 @@ def role_fault_classification(result: Dict[str, Any]) -> Dict[str, Any]:
         {"role": "system", "content": "You are a helpful assistant."},
         {"role": "user", "content": formatted_prompt},
     ]
-    response = completion(
+    # Malformed JSON from the judge is rejected and retried like any other failed call.
+    def parse(response):
+        res = json.loads(response.choices[0].message.content)
+        res['eval_cost'] = response._hidden_params["response_cost"]
+        return res
+    res = llm.complete(
+        accept=parse,
         messages=messages,
         model=MODEL,
         temperature=0.0
     )
-    res = json.loads(response.choices[0].message.content)
-    res['eval_cost'] = response._hidden_params["response_cost"]
     if 'task_id' in result:
         res['task_id'] = result['task_id']
     if 'trial' in result:
@@ -116,8 +124,9 @@ def role_fault_classification(result: Dict[str, Any]) -> Dict[str, Any]:
 
 def main() -> None:
     args = get_args()
-    with open(args.results_path, "r") as f:
-        loaded_results = json.load(f)
+    llm.configure_rate_limits(rpm=args.rpm, tpm=args.tpm)
+    llm.configure_response_cache(args.llm_cache)
+    loaded_results = load_checkpoint(args.results_path)
     print(f"Loaded {len(loaded_results)} results")
     env = args.env
     with open(f"src/envs/{env}/{args.eval_mode}_data.json", "r") as f:
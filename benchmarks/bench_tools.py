@@ -0,0 +1,246 @@
+"""Offline benchmark of the MIMIC-IV tools and the reward path.
+
+Replays the tool calls and SQL recorded in run checkpoints against the local database, with no LLM calls,
+and reports latency percentiles, throughput and peak traced memory per tool. Run from the repository root:
+
+    python -m benchmarks.bench_tools results/*.json --output bench.json
+    python -m benchmarks.bench_tools results/*.json --compare bench.json
+    python -m benchmarks.bench_tools --diff before.json after.json
+"""
+import sys
+import json
+import time
+import tracemalloc
+from argparse import ArgumentParser, Namespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.envs import get_env
+from src.envs.base import Env
+from src.envs.query_cache import configure_query_cache
+from src.envs.mimic_iv.tools.instruction_sql_search import InstructionSQLSearch
+from src.checkpoint import checkpoint_eval_mode, load_checkpoint
+from src.telemetry import format_table
+from src.types import Action
+from src.utils import extract_actions
+
+# Tool outputs starting with these are failed calls (see Env.invoke_tool and the tools' error messages).
+ERROR_PREFIXES = ("Error", "Unknown action")
+REWARD = "calculate_reward_sql"
+# A stage regresses when its p50 or p95 grows by this factor and by at least MIN_REGRESSION_SECONDS.
+DEFAULT_THRESHOLD = 1.25
+MIN_REGRESSION_SECONDS = 0.001
+
+
+def parse_arguments() -> Namespace:
+    parser = ArgumentParser(description="Replay recorded tool calls and reward computation without LLM calls")
+    parser.add_argument("checkpoints", nargs="*", help="Run checkpoints (.json or .jsonl) to replay")
+    parser.add_argument("--eval_mode", type=str, default=None, choices=["valid", "test"], help="Task set of the checkpoints (default: from each file name)")
+    parser.add_argument("--instruction_index", type=str, default="flat", choices=["flat", "hnsw", "ivf", "bm25", "hybrid"], help="Retriever benchmarked for instruction_sql_search")
+    parser.add_argument("--instruction_queries", type=int, default=200, help="Task instructions replayed through instruction_sql_search (0 to skip the tool)")
+    parser.add_argument("--query_cache_size", type=int, default=0, help="Shared SQL result cache size; 0 measures every call against SQLite")
+    parser.add_argument("--repeat", type=int, default=1, help="Timed passes over the workload")
+    parser.add_argument("--skip_memory", action="store_true", help="Skip the tracemalloc pass that measures peak memory per call")
+    parser.add_argument("--output", type=str, default=None, help="Write the results to this JSON file")
+    parser.add_argument("--compare", type=str, default=None, help="Baseline JSON written by --output to diff this run against")
+    parser.add_argument("--diff", nargs=2, metavar=("BASELINE", "CANDIDATE"), default=None, help="Diff two saved results without running anything")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Slowdown factor reported as a regression")
+    return parser.parse_args()
+
+
+def load_workload(paths: List[str], eval_mode: Optional[str]) -> Tuple[List[Tuple[str, Action]], List[Tuple[str, int, List[Action]]]]:
+    """Tool calls as (eval mode, action) and reward cases as (eval mode, task index, actions) of every episode."""
+    calls, episodes = [], []
+    for path in paths:
+        mode = eval_mode or checkpoint_eval_mode(path)
+        for record in load_checkpoint(path):
+            try:
+                actions = extract_actions(record["messages"])
+            except (KeyError, TypeError, ValueError):
+                # Errored episodes may hold no or partial trajectories.
+                continue
+            calls.extend((mode, a) for a in actions if a.name != "respond")
+            if any(a.name == "sql_db_query" for a in actions):
+                episodes.append((mode, record["task_idx"], actions))
+    return calls, episodes
+
+
+def summarize(durations: List[float], errors: int, peak_bytes: Optional[int]) -> Dict[str, Any]:
+    samples = np.array(durations)
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    total = float(samples.sum())
+    return {
+        "count": len(durations),
+        "errors": errors,
+        "p50": float(p50),
+        "p95": float(p95),
+        "p99": float(p99),
+        "mean": float(samples.mean()),
+        "total": total,
+        "throughput": len(durations) / total if total > 0 else float("inf"),
+        "peak_kb": None if peak_bytes is None else round(peak_bytes / 1024, 1),
+    }
+
+
+def time_calls(jobs: List[Tuple[str, Callable[[], Any]]], repeat: int) -> Dict[str, Tuple[List[float], int]]:
+    """Latency of every job per label, over `repeat` passes; failed tool calls are counted per label."""
+    timings: Dict[str, Tuple[List[float], int]] = {}
+    for _ in range(repeat):
+        for label, job in jobs:
+            start = time.perf_counter()
+            output = job()
+            elapsed = time.perf_counter() - start
+            durations, errors = timings.setdefault(label, ([], 0))
+            durations.append(elapsed)
+            if isinstance(output, str) and output.startswith(ERROR_PREFIXES):
+                timings[label] = (durations, errors + 1)
+    return timings
+
+
+def peak_memory(jobs: List[Tuple[str, Callable[[], Any]]]) -> Dict[str, int]:
+    """Largest memory allocated above the starting point during any single job, per label."""
+    peaks: Dict[str, int] = {}
+    tracemalloc.start()
+    try:
+        for label, job in jobs:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            job()
+            peaks[label] = max(peaks.get(label, 0), tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def reward_job(env: Env, task_index: int, actions: List[Action]) -> Callable[[], Any]:
+    def job():
+        env.task = env.tasks[task_index]
+        env.actions = actions
+        return env.calculate_reward_sql()
+    return job
+
+
+def run_benchmark(config: Namespace) -> Dict[str, Any]:
+    configure_query_cache(config.query_cache_size)
+    calls, episodes = load_workload(config.checkpoints, config.eval_mode)
+    stats: Dict[str, Dict[str, Any]] = {}
+
+    envs: Dict[str, Env] = {}
+    for mode in sorted({mode for mode, _ in calls} | {mode for mode, _, _ in episodes}):
+        start = time.perf_counter()
+        envs[mode] = get_env(env_name="mimic_iv", eval_mode=mode, user_strategy="llm", user_model=None, task_index=0, instruction_index=config.instruction_index)
+        stats[f"env_construction:{mode}"] = summarize([time.perf_counter() - start], 0, None)
+
+    jobs = [(action.name, lambda env=envs[mode], action=action: env.invoke_tool(action)) for mode, action in calls]
+    jobs += [(REWARD, reward_job(envs[mode], task_index, actions)) for mode, task_index, actions in episodes]
+
+    if config.instruction_queries > 0 and envs:
+        # Checkpoints rarely call instruction_sql_search, so it is driven by the task instructions instead.
+        try:
+            start = time.perf_counter()
+            search = InstructionSQLSearch(config.instruction_index)
+            search.get_retriever()
+            stats["instruction_sql_search:build"] = summarize([time.perf_counter() - start], 0, None)
+            env = next(iter(envs.values()))
+            instructions = [task.instruction for task in env.tasks][:config.instruction_queries]
+            jobs += [("instruction_sql_search", lambda text=text: search.invoke(text)) for text in instructions]
+        except ImportError as e:
+            print(f"Skipping instruction_sql_search ({config.instruction_index}): {e}")
+
+    if not jobs:
+        raise SystemExit("No tool calls or SQL found in the given checkpoints")
+    print(f"Replaying {len(calls)} tool calls and {len(episodes)} reward computations from {len(config.checkpoints)} checkpoints")
+    timings = time_calls(jobs, config.repeat)
+    peaks = {} if config.skip_memory else peak_memory(jobs)
+    for label in sorted(timings):
+        durations, errors = timings[label]
+        stats[label] = summarize(durations, errors, peaks.get(label))
+    return {
+        "meta": {
+            "checkpoints": config.checkpoints,
+            "instruction_index": config.instruction_index,
+            "query_cache_size": config.query_cache_size,
+            "repeat": config.repeat,
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "stats": stats,
+    }
+
+
+def ms(seconds: float) -> str:
+    return f"{seconds * 1000:.2f}"
+
+
+def report(results: Dict[str, Any]) -> None:
+    rows = [("stage", "count", "errors", "p50 ms", "p95 ms", "p99 ms", "total s", "calls/s", "peak KiB")]
+    for label, s in results["stats"].items():
+        rows.append((
+            label, s["count"], s["errors"], ms(s["p50"]), ms(s["p95"]), ms(s["p99"]),
+            f"{s['total']:.2f}", f"{s['throughput']:.1f}", "-" if s["peak_kb"] is None else s["peak_kb"],
+        ))
+    print(format_table(rows))
+
+
+def ratio(new: Optional[float], old: Optional[float]) -> str:
+    if new is None or old is None or old == 0:
+        return "-"
+    return f"{new / old:.2f}x"
+
+
+def diff(baseline: Dict[str, Any], candidate: Dict[str, Any], threshold: float) -> List[str]:
+    """Print candidate against baseline per stage and return the stages that regressed."""
+    rows = [("stage", "p50 ms", "vs base", "p95 ms", "vs base", "calls/s", "vs base", "peak KiB", "vs base", "")]
+    regressions = []
+    for label in sorted(set(baseline["stats"]) | set(candidate["stats"])):
+        old, new = baseline["stats"].get(label), candidate["stats"].get(label)
+        if old is None or new is None:
+            rows.append((label, "-", "-", "-", "-", "-", "-", "-", "-", "only in " + ("candidate" if old is None else "baseline")))
+            continue
+        regressed = any(
+            new[p] > old[p] * threshold and new[p] - old[p] >= MIN_REGRESSION_SECONDS for p in ("p50", "p95")
+        ) or (new["peak_kb"] is not None and old["peak_kb"] is not None and new["peak_kb"] > old["peak_kb"] * threshold)
+        if regressed:
+            regressions.append(label)
+        rows.append((
+            label,
+            ms(new["p50"]), ratio(new["p50"], old["p50"]),
+            ms(new["p95"]), ratio(new["p95"], old["p95"]),
+            f"{new['throughput']:.1f}", ratio(new["throughput"], old["throughput"]),
+            "-" if new["peak_kb"] is None else new["peak_kb"], ratio(new["peak_kb"], old["peak_kb"]),
+            "REGRESSION" if regressed else "",
+        ))
+    print(format_table(rows))
+    return regressions
+
+
+def main() -> int:
+    config = parse_arguments()
+    if config.diff:
+        with open(config.diff[0]) as f:
+            baseline = json.load(f)
+        with open(config.diff[1]) as f:
+            candidate = json.load(f)
+        return 1 if diff(baseline, candidate, config.threshold) else 0
+    if not config.checkpoints:
+        raise SystemExit("Give checkpoints to replay, or --diff BASELINE CANDIDATE")
+
+    results = run_benchmark(config)
+    report(results)
+    if config.output:
+        with open(config.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved benchmark results to {config.output}")
+    if config.compare:
+        with open(config.compare) as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {config.compare}:")
+        regressions = diff(baseline, results, config.threshold)
+        if regressions:
+            print(f"Regressions over {config.threshold}x: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""Re-score saved episodes without LLM calls.
+
+Rebuilds each episode's actions from its stored messages, re-executes the tools and the reward against the
+local database, and reports the updated rewards and metrics. Use it to see the effect of a change to
+`calculate_reward_sql`, `process_result` or a tool:
+
+    python replay.py results/<run>_valid.json [more checkpoints ...]
+"""
+import os
+import json
+import time
+import multiprocessing
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.envs import get_env
+from src.envs.query_cache import configure_query_cache, get_query_cache
+from src.checkpoint import checkpoint_eval_mode, load_checkpoint
+from src.types import EnvRunResult
+from src.utils import extract_actions
+from src.metrics import display_metrics
+
+
+def parse_arguments() -> Namespace:
+    parser = ArgumentParser(description="Re-execute the tools and reward of saved episodes without LLM calls")
+    parser.add_argument("checkpoints", nargs="+", help="Run checkpoints (.json or .jsonl) to replay")
+    parser.add_argument("--env", type=str, default="mimic_iv", choices=["mimic_iv"], help="Environment the episodes were run in")
+    parser.add_argument("--eval_mode", type=str, default=None, choices=["valid", "test"], help="Task set of the checkpoints (default: from each file name)")
+    parser.add_argument("--max_concurrency", type=int, default=os.cpu_count() or 1, help="Episodes replayed concurrently (per worker process)")
+    parser.add_argument("--workers", type=int, default=1, help="Processes to spread the episodes over")
+    parser.add_argument("--instruction_index", type=str, default="flat", choices=["flat", "hnsw", "ivf", "bm25", "hybrid"], help="Retriever behind instruction_sql_search; use the one the episodes were run with")
+    parser.add_argument("--skip_tools", action="store_true", help="Only recompute the reward; do not re-execute the other tool calls")
+    parser.add_argument("--query_timeout", type=float, default=30.0, help="Wall-clock limit in seconds for each SQL query (<=0 to disable)")
+    parser.add_argument("--query_max_steps", type=int, default=None, help="SQLite VM-step limit for each SQL query")
+    parser.add_argument("--query_cache_size", type=int, default=4096, help="Entries in the shared SQL result cache (0 to disable)")
+    parser.add_argument("--output_dir", type=str, default=None, help="Directory for the re-scored checkpoints (default: next to each input)")
+    return parser.parse_args()
+
+
+def replay_episode(config: Namespace, eval_mode: str, record: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+    """Re-score one saved episode; returns the updated record and how many tool observations changed."""
+    result = EnvRunResult(**record)
+    if not result.messages:
+        # The episode errored before producing a trajectory; there is nothing to replay.
+        return result.model_dump(), 0
+    env = get_env(
+        env_name=config.env,
+        eval_mode=eval_mode,
+        user_strategy="llm",
+        user_model=None,
+        task_index=result.task_idx,
+        query_timeout=config.query_timeout if config.query_timeout > 0 else None,
+        query_max_steps=config.query_max_steps,
+        instruction_index=config.instruction_index,
+    )
+    # The opening utterance is taken from the trajectory, so the user simulator is never called.
+    env.reset(task_index=result.task_idx, initial_observation="")
+    actions = extract_actions(result.messages)
+    # record_step stores exactly one tool message after every tool call, in order.
+    observations = iter([m.get("content") for m in result.messages if m.get("role") == "tool"])
+    changed = 0
+    for action in actions:
+        env.actions.append(action)
+        if action.name == "respond":
+            continue
+        recorded = next(observations, None)
+        if not config.skip_tools and env.invoke_tool(action) != recorded:
+            changed += 1
+
+    # As in Env.step, the reward is only computed once the user ended the conversation. Test-mode tasks have
+    # no gold answer, so nothing is scored and their reward stays as recorded.
+    done = any("###END###" in str(m.get("content")) for m in result.messages if m.get("role") == "user")
+    original_reward = result.reward
+    if env.task.gold_sql is not None:
+        if done:
+            reward_res = env.calculate_reward_sql()
+            result.reward = reward_res.reward
+            result.info = {**result.info, "reward_info": reward_res.model_dump()}
+        else:
+            result.reward = 0.0
+    result.info["replay"] = {"original_reward": original_reward, "changed_observations": None if config.skip_tools else changed}
+    return result.model_dump(), changed
+
+
+def replay_records(config: Namespace, eval_mode: str, records: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], int]]:
+    replay = partial(replay_episode, config, eval_mode)
+    if config.workers > 1:
+        # spawn, as in run.py: the parent may already run threads.
+        with ProcessPoolExecutor(
+            max_workers=config.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=configure_query_cache,
+            initargs=(config.query_cache_size,),
+        ) as executor:
+            return list(executor.map(replay, records, chunksize=max(1, len(records) // (config.workers * 4))))
+    with ThreadPoolExecutor(max_workers=config.max_concurrency) as executor:
+        return list(executor.map(replay, records))
+
+
+def replay_checkpoint(config: Namespace, path: str) -> Optional[str]:
+    eval_mode = config.eval_mode or checkpoint_eval_mode(path)
+    records = load_checkpoint(path)
+    if not records:
+        print(f"{path}: no results to replay")
+        return None
+    start = time.perf_counter()
+    replayed = replay_records(config, eval_mode, records)
+    elapsed = time.perf_counter() - start
+
+    results = [EnvRunResult(**record) for record, _ in replayed]
+    flips = [
+        (r.task_idx, r.trial, r.info["replay"]["original_reward"], r.reward)
+        for r in results
+        if "replay" in r.info and r.info["replay"]["original_reward"] != r.reward
+    ]
+    output_dir = config.output_dir or os.path.dirname(path)
+    os.makedirs(output_dir or ".", exist_ok=True)
+    output_path = os.path.join(output_dir, os.path.splitext(os.path.basename(path))[0] + "_replay.json")
+    with open(output_path, "w") as f:
+        json.dump([record for record, _ in replayed], f, indent=2)
+
+    print(f"Replayed {len(results)} episodes of {path} in {elapsed:.2f}s")
+    if not config.skip_tools:
+        print(f"Tool observations that differ from the recorded ones: {sum(changed for _, changed in replayed)}")
+    print(f"Rewards changed: {len(flips)}")
+    for task_idx, trial, old, new in sorted(flips):
+        print(f"  task_id={task_idx} trial={trial}: {old} -> {new}")
+    print(f"Saved re-scored results to {output_path}")
+    if eval_mode == "valid":
+        display_metrics(results)
+    return output_path
+
+
+def main() -> None:
+    config = parse_arguments()
+    configure_query_cache(config.query_cache_size)
+    for path in config.checkpoints:
+        replay_checkpoint(config, path)
+        print("-----")
+    if config.workers <= 1:
+        print(f"SQL result cache: {get_query_cache().stats()}")
+
+
+if __name__ == "__main__":
+    main()
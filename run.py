@@ -1,17 +1,24 @@
 import os
-import json
+import time
+import asyncio
 import traceback
 from argparse import ArgumentParser, Namespace
-from math import comb
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import List
 import threading
 file_lock = threading.Lock()
 
 from src.envs import get_env
+from src.envs.base import configure_tool_executor
+from src.envs.query_cache import configure_query_cache, get_query_cache
 from src.agent_factory import get_agent
+from src import telemetry
+from src.llm import backoff_delay, cache_scope, configure_rate_limits, configure_response_cache, get_response_cache, parse_rate_limit, rate_limit_stats
 from src.types import EnvRunResult, CostInfo
+from src.metrics import display_metrics
+from src.checkpoint import CheckpointWriter, compact_checkpoint, merge_shard_checkpoints, open_resume_checkpoint, shard_checkpoint_path
 from automatic_evaluation import role_fault_classification
 from dotenv import load_dotenv
 
@@ -34,77 +41,276 @@ def parse_arguments() -> Namespace:
     parser.add_argument("--end_index", type=int, required=False, default=-1, help="End index for tasks (-1 for all)")
     parser.add_argument("--task_ids", nargs='+', type=int, required=False, default=None, help="Specific task ids to run")
     parser.add_argument("--simulation_retry", type=int, required=False, default=10, help="Number of simulation retries")    
+    parser.add_argument("--episode_errors", type=int, required=False, default=3, help="Consecutive failed attempts (e.g. an LLM call out of retries) after which an episode is checkpointed as an error; --resume runs it again")
+    parser.add_argument("--query_timeout", type=float, required=False, default=30.0, help="Wall-clock limit in seconds for each agent/reward SQL query (<=0 to disable)")
+    parser.add_argument("--query_max_steps", type=int, required=False, default=None, help="SQLite VM-step limit for each agent/reward SQL query")
+    parser.add_argument("--query_cache_size", type=int, required=False, default=4096, help="Entries in the shared SQL result cache (0 to disable)")
+    parser.add_argument("--context_token_budget", type=int, required=False, default=None, help="Approximate prompt-token budget per agent turn; older tool outputs are truncated to fit (default: no limit)")
+    parser.add_argument("--schema_digest_tokens", type=int, required=False, default=None, help="Put a schema digest of at most this many tokens in the agent's system prompt (e.g. 3000; default: off)")
+    parser.add_argument("--instruction_index", type=str, required=False, default="flat", choices=["flat", "hnsw", "ivf", "bm25", "hybrid"], help="Retriever behind instruction_sql_search: dense FAISS index (hnsw/ivf are approximate), bm25 (pure NumPy, no torch) or hybrid (dense + BM25 over SQL skeletons, de-duplicated)")
+    parser.add_argument("--value_index", action="store_true", help="Answer value lookups from an FTS5 trigram index of the text columns, built next to the database on first use")
+    parser.add_argument("--rpm", type=float, required=False, default=None, help="Requests per minute allowed for each LLM (agent, user and judge)")
+    parser.add_argument("--tpm", type=float, required=False, default=None, help="Tokens per minute allowed for each LLM")
+    parser.add_argument("--rate_limit", nargs='+', type=str, required=False, default=[], help="Per-model overrides of --rpm/--tpm as MODEL=RPM[,TPM]")
+    parser.add_argument("--llm_max_retries", type=int, required=False, default=8, help="Retries (with exponential backoff) of a failed LLM call before giving up")
+    parser.add_argument("--llm_cache", type=str, required=False, default=None, help="SQLite file caching LLM responses, to replay a configuration without new calls (off by default)")
+    parser.add_argument("--llm_cache_max_mb", type=float, required=False, default=1024, help="Size limit of the LLM response cache; least recently used responses are evicted")
+    parser.add_argument("--workers", type=int, required=False, default=1, help="Processes to shard the episodes over, each with its own --max_concurrency pool and an equal share of --rpm/--tpm")
+    parser.add_argument("--async_mode", action="store_true", help="Run episodes as asyncio tasks on one event loop (use a large --max_concurrency)")
+    parser.add_argument("--tool_workers", type=int, required=False, default=4, help="Threads for SQL tool calls and reward computation in --async_mode")
+    parser.add_argument("--resume", type=str, required=False, default=None, help="Checkpoint (.jsonl or .json) of an interrupted run to resume")
     return parser.parse_args()
 
-def display_metrics(results: List[EnvRunResult]) -> None:
-    """Compute and display average reward and pass@k/pass^k metrics."""
-    def is_successful(reward: float) -> bool:
-        return (1 - 1e-6) <= reward <= (1 + 1e-6)
+def env_options(config: Namespace) -> dict:
+    """Environment settings shared by every env instance of a run."""
+    return {
+        "query_timeout": config.query_timeout if config.query_timeout > 0 else None,
+        "query_max_steps": config.query_max_steps,
+        "schema_digest_tokens": config.schema_digest_tokens,
+        "instruction_index": config.instruction_index,
+        "use_value_index": config.value_index,
+    }
 
-    unique_trials = len(set(r.trial for r in results))
-    rewards = [r.reward for r in results]
-    avg_reward = round(sum(rewards) / len(rewards) * 100, 1)
-    
-    success_counts: dict[int, int] = {}
-    for res in results:
-        success_counts[res.task_idx] = success_counts.get(res.task_idx, 0) + (1 if is_successful(res.reward) else 0)
-
-    pass_at_k = {}
-    for k in range(1, unique_trials + 1):
-        pass_k_total = sum(comb(unique_trials - success, k) / comb(unique_trials, k) for success in success_counts.values())
-        pass_at_k[k] = round((1 - (pass_k_total / len(success_counts))) * 100, 3)
-
-    pass_hat_k = {}
-    for k in range(1, unique_trials + 1):
-        pass_k_total = sum(comb(success, k) / comb(unique_trials, k) for success in success_counts.values())
-        pass_hat_k[k] = round((pass_k_total / len(success_counts)) * 100, 3)
-
-
-    print(f"📈 Pass@4: {pass_at_k[4]} (%)")
-    print(f"📈 Pass^4: {pass_hat_k[4]} (%)")
-    print(f"🏆 Final Score: {(pass_at_k[4]+pass_hat_k[4])/2} (%)")
-
-def update_checkpoint(ckpt_path, result, lock):
-    with lock:
-        data = []
-        ckpt_path = ckpt_path.replace('gemini/', '').replace('azure/', '')
-        if os.path.exists(ckpt_path):
-            with open(ckpt_path, "r") as f:
-                data = json.load(f)
-        with open(ckpt_path, "w") as f:
-            json.dump(data + [result.model_dump()], f, indent=2)
-
-def run(config: Namespace):
-
-    timestamp = datetime.now().strftime("%m%d%H%M%S")
-    checkpoint_filename = (
-        f"{config.env}-{config.agent_strategy}-{os.path.basename(config.model.replace('gemini/', '').replace('azure/', ''))}-{config.temperature}_"
-        f"range_{config.start_index}-{config.end_index}_user-{config.user_model.replace('gemini/', '').replace('azure/', '')}-{config.user_strategy}_{timestamp}_{config.eval_mode}.json"
+def configure_process(config: Namespace) -> None:
+    """Set up the process-wide caches and LLM rate limits of a run (once per worker process)."""
+    configure_query_cache(config.query_cache_size)
+    # Every worker process has its own limiters, so each gets an equal share of the per-minute limits.
+    share = lambda limit: limit / config.workers if limit is not None else None
+    configure_rate_limits(
+        rpm=share(config.rpm),
+        tpm=share(config.tpm),
+        per_model={model: (share(rpm), share(tpm)) for model, (rpm, tpm) in map(parse_rate_limit, config.rate_limit)},
+        max_retries=config.llm_max_retries,
     )
-    ckpt_path = os.path.join(config.result_dir, checkpoint_filename)
-    if not os.path.exists(config.result_dir):
-        os.makedirs(config.result_dir)
-
-    print(f"Loading user with strategy: {config.user_strategy}")
+    configure_response_cache(config.llm_cache, config.llm_cache_max_mb)
 
-    env = get_env(
+def make_env(config: Namespace, task_index=None):
+    return get_env(
         env_name=config.env,
         eval_mode=config.eval_mode,
         user_strategy=config.user_strategy,
         user_model=config.user_model,
+        task_index=task_index,
+        **env_options(config),
     )
+
+def process_stats() -> dict:
+    stats = {"SQL result cache": get_query_cache().stats(), "LLM calls": rate_limit_stats()}
+    if get_response_cache() is not None:
+        stats["LLM response cache"] = get_response_cache().stats()
+    return stats
+
+def run_episodes(config: Namespace, env, idx_to_run: List[int], trials: List[int], checkpoint: CheckpointWriter) -> List[EnvRunResult]:
+    """Run every (task index, trial) pair on this process's thread pool or event loop."""
     agent = get_agent(
             tools_info=env.tools_info,
             model=config.model,
             temperature=config.temperature,
             agent_strategy=config.agent_strategy,
-            rule=env.rule
+            rule=env.rule,
+            context_token_budget=config.context_token_budget,
+            schema_digest=env.schema_digest,
+        )
+
+    def _make_env(idx: int):
+        return make_env(config, idx)
+
+    def _fault_payload(response, isolated_env) -> dict:
+        return {
+            "messages": response.messages,
+            "instruction": isolated_env.task.instruction,
+            "gold_sql": isolated_env.task.gold_sql,
+            "gold_answer": isolated_env.task.gold_answer
+        }
+
+    def _settle(idx: int, trial: int, response, isolated_env, fault_result, simulation_retry: int, recorder):
+        """Build the result of one simulation and decide whether it is final; final results are checkpointed."""
+        result = EnvRunResult(
+            task_idx=idx,
+            trial=trial,
+            reward=response.reward,
+            info=response.info,
+            messages=response.messages,
+            cost=CostInfo(
+                agent_cost=response.agent_cost,
+                user_cost=isolated_env.get_user_cost(),
+                eval_cost=0.0,
+                total_cost=round(response.agent_cost + isolated_env.get_user_cost(), 8)
+            ),
+            spans=recorder.snapshot(),
         )
+        exit_flag = False
+        # valid mode: gold answer exists (task successful)
+        if response.reward == 1:
+            exit_flag = True
+        # valid mode: gold answer exists (task failed)
+        elif response.reward == 0:
+            if fault_result['role'] == 'agent' or simulation_retry == config.simulation_retry:
+                result.cost.eval_cost = round(fault_result['eval_cost'], 8)
+                result.cost.total_cost = round(result.cost.total_cost + fault_result['eval_cost'], 8)
+                exit_flag = True
+        # test mode: gold answer does not exist (skip evaluation)
+        else:
+            exit_flag = True
+        if exit_flag:
+            checkpoint.append(result)
+        return result, exit_flag
+
+    def _error_result(idx: int, trial: int, e: Exception, recorder) -> EnvRunResult:
+        return EnvRunResult(
+            task_idx=idx,
+            trial=trial,
+            reward=0.0,
+            info={"error": str(e), "traceback": traceback.format_exc()},
+            messages=[],
+            cost=CostInfo(),
+            spans=recorder.snapshot(),
+        )
+
+    def _give_up(result: EnvRunResult, errors: int) -> bool:
+        """After `config.episode_errors` consecutive failures, checkpoint the error instead of restarting again."""
+        if errors < config.episode_errors:
+            return False
+        checkpoint.append(result)
+        return True
+
+    def _report(idx: int, result: EnvRunResult) -> None:
+        if config.eval_mode == "valid":
+            print("✅" if result.reward == 1 else "❌", f"task_id={idx}", result.info)
+            print("-----")
+        elif config.eval_mode == "test":
+            print(f"task_id={idx}", result.info)
+
+    def _episode_scope(idx: int, trial: int, simulation_retry: int) -> tuple:
+        # Trials and re-simulations repeat the same prompts; with --llm_cache they must not replay each other.
+        return f"task={idx}", f"trial={trial}", f"simulation={simulation_retry}"
+
+    def _run(idx: int, trial: int) -> EnvRunResult:
+        simulation_retry = 0
+        errors = 0
+        exit_flag = False
+        with telemetry.recording() as recorder:
+            with telemetry.span("make_env"):
+                isolated_env = _make_env(idx)
+            while True:
+                try:
+                    with cache_scope(*_episode_scope(idx, trial, simulation_retry)), telemetry.span("episode"):
+                        response = agent.run(env=isolated_env, task_index=idx)
+                        fault_result = None
+                        if response.reward == 0:
+                            with telemetry.span("judge"):
+                                fault_result = role_fault_classification(_fault_payload(response, isolated_env))
+                            simulation_retry += 1
+                    result, exit_flag = _settle(idx, trial, response, isolated_env, fault_result, simulation_retry, recorder)
+                    errors = 0
+                except Exception as e:
+                    result = _error_result(idx, trial, e, recorder)
+                    errors += 1
+                    exit_flag = _give_up(result, errors)
+                    if not exit_flag:
+                        time.sleep(backoff_delay(errors))
+                if exit_flag:
+                    break
+                print(f"Retrying... {simulation_retry}/{config.simulation_retry}", f"task_id={idx}", result.info)
+        _report(idx, result)
+        return result
+
+    async def _arun(idx: int, trial: int, semaphore: asyncio.Semaphore) -> EnvRunResult:
+        async with semaphore:
+            simulation_retry = 0
+            errors = 0
+            exit_flag = False
+            with telemetry.recording() as recorder:
+                with telemetry.span("make_env"):
+                    isolated_env = await asyncio.to_thread(_make_env, idx)
+                while True:
+                    try:
+                        with cache_scope(*_episode_scope(idx, trial, simulation_retry)), telemetry.span("episode"):
+                            response = await agent.arun(env=isolated_env, task_index=idx)
+                            fault_result = None
+                            if response.reward == 0:
+                                with telemetry.span("judge"):
+                                    fault_result = await asyncio.to_thread(role_fault_classification, _fault_payload(response, isolated_env))
+                                simulation_retry += 1
+                        result, exit_flag = _settle(idx, trial, response, isolated_env, fault_result, simulation_retry, recorder)
+                        errors = 0
+                    except Exception as e:
+                        result = _error_result(idx, trial, e, recorder)
+                        errors += 1
+                        exit_flag = _give_up(result, errors)
+                        if not exit_flag:
+                            await asyncio.sleep(backoff_delay(errors))
+                    if exit_flag:
+                        break
+                    print(f"Retrying... {simulation_retry}/{config.simulation_retry}", f"task_id={idx}", result.info)
+            _report(idx, result)
+            return result
+
+    async def _run_all_async() -> List[EnvRunResult]:
+        # Episodes are I/O bound, so one event loop can keep many of them in flight.
+        semaphore = asyncio.Semaphore(config.max_concurrency)
+        return await asyncio.gather(*[_arun(i, t, semaphore) for i, t in zip(idx_to_run, trials)])
+
+    if config.async_mode:
+        configure_tool_executor(config.tool_workers)
+        return asyncio.run(_run_all_async())
+    with ThreadPoolExecutor(max_workers=config.max_concurrency) as executor:
+        return list(executor.map(_run, idx_to_run, trials))
+
+def run_shard(config: Namespace, shard: int, idx_to_run: List[int], trials: List[int], ckpt_path: str) -> tuple:
+    """Entry point of a `--workers` process: run its share of the episodes into its own checkpoint."""
+    configure_process(config)
+    env = make_env(config)
+    with CheckpointWriter(shard_checkpoint_path(ckpt_path, shard)) as checkpoint:
+        results = run_episodes(config, env, idx_to_run, trials, checkpoint)
+    return [r.model_dump() for r in results], process_stats()
+
+def run_sharded(config: Namespace, idx_to_run: List[int], trials: List[int], ckpt_path: str, shard_runner=run_shard) -> List[EnvRunResult]:
+    """Spread the episodes over `config.workers` processes, so embedding, result normalization and
+    SQLite work are not serialized by one GIL, and merge their checkpoints into `ckpt_path`."""
+    # Round-robin over the schedule balances the shards without knowing how long each task takes.
+    shards = [(idx_to_run[s::config.workers], trials[s::config.workers]) for s in range(config.workers)]
+    shards = [(s, i, t) for s, (i, t) in enumerate(shards) if i]
+    results: List[EnvRunResult] = []
+    try:
+        # spawn: forking a process that already runs threads (tool executor, LLM clients) is unsafe.
+        with ProcessPoolExecutor(max_workers=len(shards), mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [executor.submit(shard_runner, config, s, i, t, ckpt_path) for s, i, t in shards]
+            for (s, _, _), future in zip(shards, futures):
+                records, stats = future.result()
+                results.extend(EnvRunResult(**r) for r in records)
+                for name, value in stats.items():
+                    print(f"{name} (worker {s}): {value}")
+    finally:
+        # Merge only after every worker has exited (leaving the pool waits for them), so no shard is still
+        # being written; even if a worker died, what the others finished is kept for --resume.
+        merge_shard_checkpoints(ckpt_path)
+    return results
+
+def run(config: Namespace):
+    configure_process(config)
+
+    timestamp = datetime.now().strftime("%m%d%H%M%S")
+    checkpoint_filename = (
+        f"{config.env}-{config.agent_strategy}-{os.path.basename(config.model.replace('gemini/', '').replace('azure/', ''))}-{config.temperature}_"
+        f"range_{config.start_index}-{config.end_index}_user-{config.user_model.replace('gemini/', '').replace('azure/', '')}-{config.user_strategy}_{timestamp}_{config.eval_mode}.jsonl"
+    )
+    ckpt_path = os.path.join(config.result_dir, checkpoint_filename)
+    prior_results: List[EnvRunResult] = []
+    if config.resume:
+        ckpt_path, records = open_resume_checkpoint(config.resume)
+        prior_results = [EnvRunResult(**r) for r in records]
+        print(f"Resuming from {config.resume}: {len(prior_results)} results already completed")
+    if not os.path.exists(config.result_dir):
+        os.makedirs(config.result_dir)
+
+    print(f"Loading user with strategy: {config.user_strategy}")
+
+    env = make_env(config)
     
     total_tasks = len(env.tasks)
     end_index = total_tasks if config.end_index == -1 else min(config.end_index, total_tasks)
     results: List[EnvRunResult] = []
-    lock = threading.Lock()
 
     if config.task_ids:
         print(f"Running tasks: {config.task_ids} (checkpoint path: {ckpt_path})")
@@ -117,78 +323,35 @@ def run(config: Namespace):
         idx = list(range(config.start_index, end_index))
     idx_to_run = idx * config.num_trials
     trials = [i for i in range(1, config.num_trials + 1) for _ in idx]
-    
-    def _run(idx: int, trial: int) -> EnvRunResult:
-        simulation_retry = 0
-        isolated_env = get_env(
-            env_name=config.env,
-            eval_mode=config.eval_mode,
-            user_strategy=config.user_strategy,
-            user_model=config.user_model,
-            task_index=idx,
-        )
-        exit_flag = False
-        while True:
-            try:
-                response = agent.run(env=isolated_env, task_index=idx)
-                result = EnvRunResult(
-                    task_idx=idx,
-                    trial=trial,
-                    reward=response.reward,
-                    info=response.info,
-                    messages=response.messages,
-                    cost=CostInfo(
-                        agent_cost=response.agent_cost,
-                        user_cost=isolated_env.user.get_total_cost(),
-                        eval_cost=0.0,
-                        total_cost=round(response.agent_cost + isolated_env.user.get_total_cost(), 8)
-                    )
-                )
-                # valid mode: gold answer exists (task successful)
-                if response.reward == 1:
-                    update_checkpoint(ckpt_path, result, lock)
-                    exit_flag = True
-                # valid mode: gold answer exists (task failed)
-                elif response.reward == 0:
-                    fault_result = role_fault_classification({
-                        "messages": response.messages,
-                        "instruction": isolated_env.task.instruction,
-                        "gold_sql": isolated_env.task.gold_sql,
-                        "gold_answer": isolated_env.task.gold_answer
-                    })
-                    simulation_retry += 1
-                    if fault_result['role'] == 'agent' or simulation_retry == config.simulation_retry:
-                        result.cost.eval_cost = round(fault_result['eval_cost'], 8)
-                        result.cost.total_cost = round(result.cost.total_cost + fault_result['eval_cost'], 8)
-                        update_checkpoint(ckpt_path, result, lock)
-                        exit_flag = True
-                # test mode: gold answer does not exist (skip evaluation)
-                else:
-                    update_checkpoint(ckpt_path, result, lock)
-                    exit_flag = True
-            except Exception as e:
-                result = EnvRunResult(
-                    task_idx=idx,
-                    trial=trial,
-                    reward=0.0,
-                    info={"error": str(e), "traceback": traceback.format_exc()},
-                    messages=[],
-                    cost=CostInfo()
-                )
-            if exit_flag:
-                break
-            print(f"Retrying... {simulation_retry}/{config.simulation_retry}", f"task_id={idx}", result.info)
-        if config.eval_mode == "valid":
-            print("✅" if result.reward == 1 else "❌", f"task_id={idx}", result.info)
-            print("-----")
-        elif config.eval_mode == "test":
-            print(f"task_id={idx}", result.info)
-        return result
 
-    with ThreadPoolExecutor(max_workers=config.max_concurrency) as executor:
-        res = list(executor.map(_run, idx_to_run, trials))
-        results.extend(res)
+    # Only schedule the (task_idx, trial) pairs that the resumed checkpoint does not already cover.
+    requested = set(zip(idx_to_run, trials))
+    completed = {}
+    for r in prior_results:
+        # Episodes that ended in an error are run again.
+        if (r.task_idx, r.trial) in requested and "error" not in r.info:
+            completed.setdefault((r.task_idx, r.trial), r)
+    if completed:
+        pending = [(i, t) for i, t in zip(idx_to_run, trials) if (i, t) not in completed]
+        idx_to_run = [i for i, _ in pending]
+        trials = [t for _, t in pending]
+        results.extend(completed.values())
+        print(f"Skipping {len(completed)} completed runs; {len(pending)} remaining")
+
+    if config.workers > 1 and idx_to_run:
+        results.extend(run_sharded(config, idx_to_run, trials, ckpt_path))
+    else:
+        with CheckpointWriter(ckpt_path) as checkpoint:
+            results.extend(run_episodes(config, env, idx_to_run, trials, checkpoint))
+    print(f"Saved results to {compact_checkpoint(ckpt_path)}")
 
+    if config.workers <= 1:
+        for name, value in process_stats().items():
+            print(f"{name}: {value}")
+    spans = [span for r in results for span in r.spans]
+    if spans:
+        print("Latency by stage (seconds; tool rows per tool name):")
+        print(telemetry.format_summary(spans))
     if config.eval_mode == "valid":
         display_metrics(results)
 
@@ -7,6 +7,8 @@ def get_agent(
     agent_strategy: str = "tool-calling",
     temperature: float = 0.0,
     rule: str = "",
+    context_token_budget: Optional[int] = None,
+    schema_digest: Optional[str] = None,
 ) -> Agent:
     if agent_strategy == "tool-calling":
         from src.agents.tool_calling_agent import ToolCallingAgent
@@ -15,6 +17,8 @@ def get_agent(
             model=model,
             temperature=temperature,
             rule=rule,
+            context_token_budget=context_token_budget,
+            schema_digest=schema_digest,
         )
     else:
         # TODO: implement your own agent and return it here
@@ -1,4 +1,5 @@
 import abc
+import asyncio
 from typing import Optional
 from src.envs.base import Env
 from src.types import AgentRunResult
@@ -9,3 +10,9 @@ class Agent(abc.ABC):
         self, env: Env, task_index: Optional[int] = None, max_num_steps: int = 30
     ) -> AgentRunResult:
         raise NotImplementedError
+
+    async def arun(
+        self, env: Env, task_index: Optional[int] = None, max_num_steps: int = 30
+    ) -> AgentRunResult:
+        # Agents without a native async implementation run the blocking episode on a worker thread.
+        return await asyncio.to_thread(self.run, env, task_index, max_num_steps)
@@ -0,0 +1,52 @@
+from typing import Any, Dict, List, Optional
+
+from src.utils import estimate_tokens
+
+# Tool observations among the last this-many are always sent verbatim.
+DEFAULT_KEEP_RECENT = 3
+# Characters of a stale observation kept when it is truncated.
+STALE_HEAD_CHARS = 400
+
+
+class ContextCompactor:
+    """Shrinks the prompt of a long episode to a token budget before each completion.
+
+    Only the copy sent to the model is compacted; the agent keeps the full trajectory. The system
+    prompt, every user/assistant turn and the most recent tool observations stay verbatim. Older tool
+    observations are first cut to their head and, if the prompt is still over budget, replaced by a stub.
+    Tool messages are never dropped, so every tool call keeps its matching result.
+    """
+
+    def __init__(self, token_budget: Optional[int] = None, keep_recent: int = DEFAULT_KEEP_RECENT) -> None:
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+
+    @staticmethod
+    def truncate(message: Dict[str, Any]) -> Dict[str, Any]:
+        content = str(message.get("content") or "")
+        if len(content) <= STALE_HEAD_CHARS:
+            return message
+        head = content[:STALE_HEAD_CHARS]
+        # Cut at a line boundary so a schema or result row is not split mid-way.
+        if "\n" in head:
+            head = head.rsplit("\n", 1)[0]
+        note = f"\n[... {len(content) - len(head)} more characters of this earlier {message.get('name', 'tool')} result omitted; call the tool again if you need them]"
+        return {**message, "content": head + note}
+
+    @staticmethod
+    def stub(message: Dict[str, Any]) -> Dict[str, Any]:
+        return {**message, "content": f"[Earlier {message.get('name', 'tool')} result omitted to save context; call the tool again if you need it]"}
+
+    def compact(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if self.token_budget is None or estimate_tokens(messages) <= self.token_budget:
+            return messages
+        tool_positions = [i for i, m in enumerate(messages) if m.get("role") == "tool"]
+        stale = tool_positions[:-self.keep_recent] if self.keep_recent > 0 else tool_positions
+        compacted = list(messages)
+        # Oldest observations go first; stop as soon as the prompt fits.
+        for shrink in (self.truncate, self.stub):
+            for i in stale:
+                compacted[i] = shrink(compacted[i])
+                if estimate_tokens(compacted) <= self.token_budget:
+                    return compacted
+        return compacted
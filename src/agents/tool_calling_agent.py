@@ -1,14 +1,17 @@
 import random
-import time
+import asyncio
+import contextvars
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List, Optional
 
-from litellm import completion
-
 from src.agents.base import Agent
+from src.agents.context import ContextCompactor
 from src.envs.base import Env
-from src.types import AgentRunResult
-from src.utils import convert_message_to_action
+from src.envs.user import BaseUser
+from src import llm, telemetry
+from src.types import Action, AgentRunResult, EnvResponse
+from src.utils import convert_message_to_action, estimate_tokens
 
 # TOOL_CALLING_INSTRUCTION = """- You are a SQL agent that translates natural language questions into precise SQL queries for electronic health records (EHR).
 # - You are currently engaged in a conversation with a user who wants to retrieve data from an EHR database.
@@ -184,7 +187,7 @@ Hard rules
 1. Before generating SQL you **must** call `instruction_sql_search` once.  
 2. At most one tool call per turn.  
 3. If the user request lacks a date, lab test, cohort, etc., ask a clarifying question and make the user provide all details. Users make mistakes so make them reconfirm.
-4. Never invent schema or values. Resolve abbreviations (e.g. Hb→hemoglobin) with `value_substring_search`.  
+4. Never invent schema or values. Resolve abbreviations (e.g. Hb→hemoglobin) with `value_fuzzy_search` or `value_substring_search`.  
 5. When you finally produce SQL, rewrite it from scratch and validate with `sql_db_query`.  
 6. Your performance is graded only on that final SQL.
 
@@ -194,6 +197,13 @@ Available tools
 3. "value_substring_search" :  lookup values  
 4. "instruction_sql_search" :  fetch similar examples **(call once)**  
 5. "sql_db_query":  run SQL and return rows
+6. "value_fuzzy_search" :  ranked approximate value matches (abbreviations, misspellings) in one call
+"""
+
+SCHEMA_DIGEST_SECTION = """
+
+Database schema (tables with columns, primary keys, foreign keys and the values of low-cardinality columns).
+You do not need sql_db_list_tables for these tables; call sql_db_schema only for sample rows:
 """
 
 class ToolCallingAgent(Agent):
@@ -203,12 +213,17 @@ class ToolCallingAgent(Agent):
         rule: str,
         model: str,
         temperature: float = 0.0,
+        context_token_budget: Optional[int] = None,
+        schema_digest: Optional[str] = None,
     ):
         self.tools_info = tools_info
         self.rule = rule
         self.model = model
         self.temperature = temperature
+        self.context = ContextCompactor(context_token_budget)
         self.instruction = TOOL_CALLING_INSTRUCTION + '\nRules:\n'+self.rule
+        if schema_digest:
+            self.instruction += SCHEMA_DIGEST_SECTION + schema_digest
 
     def get_sampled_observation(self,obs_list):
         """
@@ -236,70 +251,169 @@ class ToolCallingAgent(Agent):
 
         return sampled_obs, count
 
+    @staticmethod
+    def next_wave(sampled_obs: List[str], user_samples: int, majority: int) -> int:
+        """How many more openings to sample: none once one has a majority, else just enough for one to reach it.
+
+        When a majority can no longer be reached, the rest of the budget is sampled so the final
+        choice sees all `user_samples` openings, as before.
+        """
+        top = max(Counter(sampled_obs).values(), default=0)
+        remaining = user_samples - len(sampled_obs)
+        if top >= majority or remaining <= 0:
+            return 0
+        return min(majority - top, remaining)
+
+    def sample_reset(self, env: Env, task_index: Optional[int], user_samples: int) -> EnvResponse:
+        """Reset up to `user_samples` independent users and start the episode with the most frequent opening.
+
+        Users are sampled in waves: first `majority` of them concurrently, then only as many as could still
+        produce a majority. Each wave is awaited in full, so no discarded completion outlives the reset and
+        `env.get_user_cost()` already includes every sample.
+        """
+        if user_samples <= 1:
+            return env.reset(task_index=task_index)
+        if task_index is None:
+            task_index = random.randint(0, len(env.tasks) - 1)
+        instruction = env.tasks[task_index].instruction
+        majority = user_samples // 2 + 1
+
+        sampled_obs = []
+        sampled_users = []
+        with ThreadPoolExecutor(max_workers=majority) as executor:
+            wave = majority
+            while wave:
+                users = [env.spawn_user() for _ in range(wave)]
+                # Each sample runs in a copy of the caller's context so it keeps the episode's LLM cache scope.
+                futures = [
+                    executor.submit(contextvars.copy_context().run, self._reset_sample, user, instruction, len(sampled_obs) + i)
+                    for i, user in enumerate(users)
+                ]
+                for user, future in zip(users, futures):
+                    sampled_obs.append(future.result())
+                    sampled_users.append(user)
+                wave = self.next_wave(sampled_obs, user_samples, majority)
+
+        most_common_obs, _count = self.get_sampled_observation(sampled_obs)
+        user = sampled_users[sampled_obs.index(most_common_obs)]
+        return env.reset(task_index=task_index, user=user, initial_observation=most_common_obs)
+
+    @staticmethod
+    def _reset_sample(user: BaseUser, instruction: str, sample: int) -> str:
+        # Samples share one prompt, so the cache key must tell them apart.
+        with llm.cache_scope(f"sample={sample}"):
+            return user.reset(instruction)
+
+    @staticmethod
+    async def _areset_sample(user: BaseUser, instruction: str, sample: int) -> str:
+        with llm.cache_scope(f"sample={sample}"):
+            return await user.areset(instruction)
+
+    async def asample_reset(self, env: Env, task_index: Optional[int], user_samples: int) -> EnvResponse:
+        """Async `sample_reset`: each wave runs as concurrent tasks, which are cancelled and awaited if one fails."""
+        if user_samples <= 1:
+            return await env.areset(task_index=task_index)
+        if task_index is None:
+            task_index = random.randint(0, len(env.tasks) - 1)
+        instruction = env.tasks[task_index].instruction
+        majority = user_samples // 2 + 1
+
+        sampled_obs = []
+        sampled_users = []
+        wave = majority
+        while wave:
+            users = [env.spawn_user() for _ in range(wave)]
+            tasks = [
+                asyncio.ensure_future(self._areset_sample(user, instruction, len(sampled_obs) + i))
+                for i, user in enumerate(users)
+            ]
+            try:
+                observations = await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+            sampled_obs.extend(observations)
+            sampled_users.extend(users)
+            wave = self.next_wave(sampled_obs, user_samples, majority)
+
+        most_common_obs, _count = self.get_sampled_observation(sampled_obs)
+        user = sampled_users[sampled_obs.index(most_common_obs)]
+        return await env.areset(task_index=task_index, user=user, initial_observation=most_common_obs)
+
+    def complete(self, messages: List[Dict[str, Any]]) -> Any:
+        return llm.complete(
+            messages=messages,
+            model=self.model,
+            tools=self.tools_info,
+            temperature=self.temperature,
+        )
+
+    async def acomplete(self, messages: List[Dict[str, Any]]) -> Any:
+        return await llm.acomplete(
+            messages=messages,
+            model=self.model,
+            tools=self.tools_info,
+            temperature=self.temperature,
+        )
+
+    @staticmethod
+    def prompt_tokens(res: Any, prompt: List[Dict[str, Any]]) -> int:
+        """Prompt tokens of one turn as reported by the provider, else estimated."""
+        usage = getattr(res, "usage", None)
+        return getattr(usage, "prompt_tokens", None) or estimate_tokens(prompt)
+
+    def record_step(
+        self, messages: List[Dict[str, Any]], next_message: Dict[str, Any], action: Action, env_response: EnvResponse
+    ) -> None:
+        if action.name != 'respond':
+            next_message["tool_calls"] = next_message["tool_calls"][:1]
+            messages.extend(
+                [
+                    next_message,
+                    {
+                        "role": "tool",
+                        "tool_call_id": next_message["tool_calls"][0]["id"],
+                        "name": next_message["tool_calls"][0]["function"]["name"],
+                        "content": env_response.observation,
+                    },
+                ]
+            )
+        else:
+            messages.extend(
+                [
+                    next_message,
+                    {"role": "user", "content": env_response.observation},
+                ]
+            )
+
     def run(
         self, env: Env, task_index: Optional[int] = None, max_num_steps: int = 30, user_samples: int = 10
     ) -> AgentRunResult:
         agent_cost = 0.0
-        env_reset_res = env.reset(task_index=task_index)
+        with telemetry.span("reset"):
+            env_reset_res = self.sample_reset(env, task_index, user_samples)
         obs_user = env_reset_res.observation
         env_info = env_reset_res.info.model_dump()
         
-        sampled_obs = []
-        sampled_env = []
-        for _ in range(user_samples):
-            env_reset_res = env.reset(task_index=task_index)
-            sampled_obs.append(env_reset_res.observation)
-            sampled_env.append(env_reset_res)
-
-        most_common_obs, _count = self.get_sampled_observation(sampled_obs)
-        index_of_most_common = sampled_obs.index(most_common_obs)
-        env_reset_res = sampled_env[index_of_most_common]
-        env_info = env_reset_res.info.model_dump()
-        
         reward = 0.0
         messages: List[Dict[str, Any]] = [
             {"role": "system", "content": self.instruction},
             {"role": "user", "content": obs_user},
         ]
+        prompt_tokens: List[int] = []
         for _ in range(max_num_steps):
-            while True:
-                try:
-                    res = completion(
-                        messages=messages,
-                        model=self.model,
-                        tools=self.tools_info,
-                        temperature=self.temperature,
-                    )
-                    agent_cost += res._hidden_params["response_cost"]
-                    break
-                except Exception as e:
-                    time.sleep(3)
-                    print(e, end='\r')
+            prompt = self.context.compact(messages)
+            with telemetry.span("agent_step"):
+                res = self.complete(prompt)
+            agent_cost += res._hidden_params["response_cost"]
+            prompt_tokens.append(self.prompt_tokens(res, prompt))
             next_message = res.choices[0].message.model_dump()
             action = convert_message_to_action(next_message)
             env_response = env.step(action)
             reward = env_response.reward
             env_info = {**env_info, **env_response.info.model_dump()}
-            if action.name != 'respond':
-                next_message["tool_calls"] = next_message["tool_calls"][:1]
-                messages.extend(
-                    [
-                        next_message,
-                        {
-                            "role": "tool",
-                            "tool_call_id": next_message["tool_calls"][0]["id"],
-                            "name": next_message["tool_calls"][0]["function"]["name"],
-                            "content": env_response.observation,
-                        },
-                    ]
-                )
-            else:
-                messages.extend(
-                    [
-                        next_message,
-                        {"role": "user", "content": env_response.observation},
-                    ]
-                )
+            self.record_step(messages, next_message, action, env_response)
             if env_response.done:
                 break
 
@@ -307,6 +421,42 @@ class ToolCallingAgent(Agent):
             reward=reward,
             messages=messages,
             agent_cost=round(agent_cost, 8),
-            info=env_info
+            info={**env_info, "prompt_tokens": prompt_tokens}
         )
 
+    async def arun(
+        self, env: Env, task_index: Optional[int] = None, max_num_steps: int = 30, user_samples: int = 10
+    ) -> AgentRunResult:
+        agent_cost = 0.0
+        with telemetry.span("reset"):
+            env_reset_res = await self.asample_reset(env, task_index, user_samples)
+        obs_user = env_reset_res.observation
+        env_info = env_reset_res.info.model_dump()
+
+        reward = 0.0
+        messages: List[Dict[str, Any]] = [
+            {"role": "system", "content": self.instruction},
+            {"role": "user", "content": obs_user},
+        ]
+        prompt_tokens: List[int] = []
+        for _ in range(max_num_steps):
+            prompt = self.context.compact(messages)
+            with telemetry.span("agent_step"):
+                res = await self.acomplete(prompt)
+            agent_cost += res._hidden_params["response_cost"]
+            prompt_tokens.append(self.prompt_tokens(res, prompt))
+            next_message = res.choices[0].message.model_dump()
+            action = convert_message_to_action(next_message)
+            env_response = await env.astep(action)
+            reward = env_response.reward
+            env_info = {**env_info, **env_response.info.model_dump()}
+            self.record_step(messages, next_message, action, env_response)
+            if env_response.done:
+                break
+
+        return AgentRunResult(
+            reward=reward,
+            messages=messages,
+            agent_cost=round(agent_cost, 8),
+            info={**env_info, "prompt_tokens": prompt_tokens}
+        )
@@ -0,0 +1,129 @@
+import os
+import glob
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.types import EnvRunResult
+
+
+class CheckpointWriter:
+    """Append-only JSONL checkpoint: one `EnvRunResult` per line, O(1) per result."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+        # When resuming after a crash, start on a fresh line so a truncated record cannot swallow the next one.
+        if self._file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write("\n")
+
+    def append(self, result: EnvRunResult) -> None:
+        line = json.dumps(result.model_dump()) + "\n"
+        # The lock only guards the write itself so lines from different threads never interleave.
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def __enter__(self) -> "CheckpointWriter":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def load_checkpoint(path: str) -> List[Dict[str, Any]]:
+    """Load results from either a JSONL checkpoint or a compacted JSON list."""
+    if not path.endswith(".jsonl"):
+        with open(path, "r") as f:
+            return json.load(f)
+    data = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                data.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A crash mid-write can leave a truncated last line; everything before it is intact.
+                continue
+    return data
+
+
+def checkpoint_eval_mode(path: str) -> str:
+    """Task set of a run.py checkpoint, from the `_valid`/`_test` suffix of its file name."""
+    return "test" if os.path.splitext(path)[0].endswith("_test") else "valid"
+
+
+def compact_checkpoint(jsonl_path: str, json_path: Optional[str] = None) -> str:
+    """Export a JSONL checkpoint to the JSON list format read by visualizer.py and automatic_evaluation.py."""
+    if json_path is None:
+        json_path = os.path.splitext(jsonl_path)[0] + ".json"
+    data = load_checkpoint(jsonl_path)
+    # --resume reruns errored episodes, so an episode may have several records: keep its last successful
+    # one, or its last error if it never finished.
+    episodes: Dict[Tuple[int, int], Dict[str, Any]] = {}
+    for r in data:
+        key = (r["task_idx"], r["trial"])
+        if key not in episodes or "error" not in r["info"] or "error" in episodes[key]["info"]:
+            episodes[key] = r
+    data = list(episodes.values())
+    tmp_path = f"{json_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, json_path)
+    return json_path
+
+
+def shard_checkpoint_path(path: str, shard: int) -> str:
+    """Checkpoint written by worker process `shard` of a `--workers` run checkpointing to `path`."""
+    return f"{os.path.splitext(path)[0]}.shard{shard}.jsonl"
+
+
+def merge_shard_checkpoints(path: str) -> int:
+    """Append the records of every shard checkpoint of `path` to it, delete the shards and return the count."""
+    shard_paths = sorted(glob.glob(glob.escape(os.path.splitext(path)[0]) + ".shard*.jsonl"))
+    merged = 0
+    if not shard_paths:
+        return merged
+    with CheckpointWriter(path) as writer:
+        for shard_path in shard_paths:
+            for record in load_checkpoint(shard_path):
+                writer.append(EnvRunResult(**record))
+                merged += 1
+    for shard_path in shard_paths:
+        os.remove(shard_path)
+    return merged
+
+
+def open_resume_checkpoint(path: str) -> Tuple[str, List[Dict[str, Any]]]:
+    """Return the JSONL path to keep appending to and the results it already holds.
+
+    A compacted `.json` checkpoint is converted to its `.jsonl` sibling first, unless that
+    sibling already exists (it is then the more complete record of the run). Shard checkpoints
+    left behind by an interrupted `--workers` run are folded into the JSONL checkpoint.
+    """
+    jsonl_path = path if path.endswith(".jsonl") else os.path.splitext(path)[0] + ".jsonl"
+    merge_shard_checkpoints(jsonl_path)
+    if os.path.exists(jsonl_path):
+        return jsonl_path, load_checkpoint(jsonl_path)
+    records = load_checkpoint(path)
+    with open(jsonl_path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    return jsonl_path, records
+
+
+if __name__ == "__main__":
+    import sys
+    for path in sys.argv[1:]:
+        print(f"Compacted {path} -> {compact_checkpoint(path)}")
@@ -1,11 +1,16 @@
 import os
 import random
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from src.types import Tool
-from src.utils import process_result
-from typing import Dict, List, Type, Optional
+from src.utils import process_result, sql_query_budget, QueryTimeoutError, DEFAULT_QUERY_TIMEOUT
+from typing import Any, Dict, FrozenSet, List, Type, Optional, Tuple
 
 import sqlite3
-from src.envs.user import load_user
+from src.envs.user import BaseUser, load_user
+from src.envs.query_cache import get_query_cache
+from src import telemetry
 from src.types import (
     Action,
     Task,
@@ -14,6 +19,30 @@ from src.types import (
     RewardInfo,
 )
 
+DEFAULT_TOOL_WORKERS = 4
+
+_tool_executor: Optional[ThreadPoolExecutor] = None
+_tool_executor_lock = threading.Lock()
+
+
+def get_tool_executor() -> ThreadPoolExecutor:
+    """Small shared pool that runs blocking tool calls and reward computation for async episodes."""
+    global _tool_executor
+    with _tool_executor_lock:
+        if _tool_executor is None:
+            _tool_executor = ThreadPoolExecutor(max_workers=DEFAULT_TOOL_WORKERS, thread_name_prefix="env-tools")
+        return _tool_executor
+
+
+def configure_tool_executor(max_workers: int) -> ThreadPoolExecutor:
+    global _tool_executor
+    with _tool_executor_lock:
+        if _tool_executor is not None:
+            _tool_executor.shutdown(wait=False)
+        _tool_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="env-tools")
+        return _tool_executor
+
+
 class Env(object):
     def __init__(
         self,
@@ -24,6 +53,9 @@ class Env(object):
         db_path: str,
         task_index: Optional[int] = None,
         rule: Optional[str] = None,
+        query_timeout: Optional[float] = DEFAULT_QUERY_TIMEOUT,
+        query_max_steps: Optional[int] = None,
+        schema_digest: Optional[str] = None,
     ) -> None:
         super().__init__()
         self.tools_map: Dict[str, Type[Tool]] = {
@@ -37,19 +69,50 @@ class Env(object):
             self.task_index = random.randint(0, len(tasks)-1)
         self.task = tasks[self.task_index]
         self.rule = rule
-        self.user = load_user(
-            user_strategy=user_strategy, model=user_model
-        )
+        self.user_strategy = user_strategy
+        self.user_model = user_model
+        self._users: List[BaseUser] = []
+        self._users_lock = threading.Lock()
+        self.user = self.spawn_user()
         self.actions: List[Action] = []
         self.db_path = db_path
+        self._gold_answer: Optional[Tuple[Task, Any]] = None
+        self._gold_values: Optional[FrozenSet[Any]] = None
+        self.query_timeout = query_timeout
+        self.query_max_steps = query_max_steps
+        # Optional compact schema description handed to the agent up front.
+        self.schema_digest = schema_digest
+
+    def spawn_user(self) -> BaseUser:
+        """Create an independent user simulator; its cost is included in `get_user_cost`."""
+        user = load_user(
+            user_strategy=self.user_strategy, model=self.user_model
+        )
+        with self._users_lock:
+            self._users.append(user)
+        return user
 
-    def reset(self, task_index: Optional[int] = None) -> EnvResponse:
+    def get_user_cost(self) -> float:
+        """Total cost of every user simulator created by this env, including discarded samples."""
+        with self._users_lock:
+            return round(sum(user.get_total_cost() for user in self._users), 8)
+
+    def reset(
+        self,
+        task_index: Optional[int] = None,
+        user: Optional[BaseUser] = None,
+        initial_observation: Optional[str] = None,
+    ) -> EnvResponse:
+        """Start a task. Pass `user` and `initial_observation` to adopt a user that was already reset elsewhere."""
         if task_index is None:
             task_index = random.randint(0, len(self.tasks)-1)
         self.task_index = task_index
         self.task = self.tasks[task_index]
         self.actions = []
-        initial_observation = self.user.reset(instruction=self.task.instruction)
+        if user is not None:
+            self.user = user
+        if initial_observation is None:
+            initial_observation = self.user.reset(instruction=self.task.instruction)
         return EnvResponse(
             observation=initial_observation,
             reward=0.0,
@@ -57,24 +120,30 @@ class Env(object):
             info=EnvInfo(task=self.task, reward_info=RewardInfo())
         )
 
-    def step(self, action: Action) -> EnvResponse:
-        self.actions.append(action)
+    async def areset(
+        self,
+        task_index: Optional[int] = None,
+        user: Optional[BaseUser] = None,
+        initial_observation: Optional[str] = None,
+    ) -> EnvResponse:
+        if task_index is None:
+            task_index = random.randint(0, len(self.tasks)-1)
+        if initial_observation is None:
+            initial_observation = await (user or self.user).areset(instruction=self.tasks[task_index].instruction)
+        return self.reset(task_index=task_index, user=user, initial_observation=initial_observation)
 
-        info = EnvInfo(task=self.task, reward_info=RewardInfo())
-        reward = 0.0
-        done = False
-        if action.name == 'respond':
-            observation = self.user.step(action.kwargs["content"])
-            done = "###END###" in observation
-        elif action.name in self.tools_map:
+    def invoke_tool(self, action: Action) -> str:
+        if action.name in self.tools_map:
             try:
-                observation = self.tools_map[action.name].invoke(**action.kwargs)
+                return self.tools_map[action.name].invoke(**action.kwargs)
             except Exception as e:
-                observation = f"Error: {e}"
-        else:
-            observation = f"Unknown action {action.name}"
+                return f"Error: {e}"
+        return f"Unknown action {action.name}"
+
+    def build_response(self, observation: str, done: bool, reward_res: Optional[RewardInfo]) -> EnvResponse:
+        info = EnvInfo(task=self.task, reward_info=RewardInfo())
+        reward = 0.0
         if done:
-            reward_res = self.calculate_reward_sql()
             reward = reward_res.reward
             info.reward_info = reward_res
         return EnvResponse(
@@ -83,47 +152,120 @@ class Env(object):
             done=done,
             info=info)
 
+    def step(self, action: Action) -> EnvResponse:
+        self.actions.append(action)
+
+        done = False
+        if action.name == 'respond':
+            with telemetry.span("user_step"):
+                observation = self.user.step(action.kwargs["content"])
+            done = "###END###" in observation
+        else:
+            with telemetry.span("tool", action.name):
+                observation = self.invoke_tool(action)
+        reward_res = None
+        if done:
+            with telemetry.span("reward"):
+                reward_res = self.calculate_reward_sql()
+        return self.build_response(observation, done, reward_res)
+
+    async def astep(self, action: Action) -> EnvResponse:
+        """Async `step`: the user turn is awaited, SQL tools and reward run on the shared tool executor."""
+        self.actions.append(action)
+
+        loop = asyncio.get_running_loop()
+        done = False
+        if action.name == 'respond':
+            with telemetry.span("user_step"):
+                observation = await self.user.astep(action.kwargs["content"])
+            done = "###END###" in observation
+        else:
+            # Spans include the wait for a free tool worker, which is part of the episode's wall-clock time.
+            with telemetry.span("tool", action.name):
+                observation = await loop.run_in_executor(get_tool_executor(), self.invoke_tool, action)
+        reward_res = None
+        if done:
+            with telemetry.span("reward"):
+                reward_res = await loop.run_in_executor(get_tool_executor(), self.calculate_reward_sql)
+        return self.build_response(observation, done, reward_res)
+
+    def get_gold_answer(self) -> Any:
+        """The task's gold answer in normalized form, computed once per task."""
+        if self._gold_answer is None or self._gold_answer[0] is not self.task:
+            self._gold_answer = (self.task, process_result(self.task.gold_answer))
+            self._gold_values = None
+        return self._gold_answer[1]
+
+    def get_gold_values(self) -> FrozenSet[Any]:
+        """Distinct first-column values of the gold answer, matched against each column of a multi-column prediction."""
+        gold_answer = self.get_gold_answer()
+        if self._gold_values is None:
+            self._gold_values = frozenset([el[0] for el in gold_answer])
+        return self._gold_values
+
+    def score_sql(self, query: str, conn: sqlite3.Connection) -> RewardInfo:
+        """Score one candidate SQL query, executing it only if no cached result exists."""
+        reward = 0.0
+        error = None
+        try:
+            gold_answer = self.get_gold_answer()
+            cache = get_query_cache()
+            answer_key = cache.make_key(self.db_path, "reward", query)
+            pred_sql_answer = cache.get(answer_key)
+            if pred_sql_answer is None:
+                # Reuse the rows sql_db_query fetched if it saw the complete result.
+                rows = cache.get(cache.make_key(self.db_path, "rows", query))
+                if rows is None:
+                    cursor = conn.cursor()
+                    with sql_query_budget(conn, self.query_timeout, self.query_max_steps):
+                        cursor.execute(query)
+                        rows = cursor.fetchall()
+                pred_sql_answer = process_result(rows)
+                cache.put(answer_key, pred_sql_answer)
+            # returning a single column
+            if pred_sql_answer and len(pred_sql_answer) > 0:
+                if len(pred_sql_answer[0]) == 1:
+                    if pred_sql_answer == gold_answer:
+                        reward = 1.0
+                # returning multiple columns
+                else:
+                    converted_pred_sql_answer = list(zip(*pred_sql_answer))
+                    gold_values = self.get_gold_values()
+                    for i in range(len(converted_pred_sql_answer)):
+                        if set([r for r in converted_pred_sql_answer[i] if r != 'None']) == gold_values:
+                            reward = 1.0
+                            break
+        except sqlite3.Error as e:
+            pred_sql_answer = []
+        except QueryTimeoutError as e:
+            pred_sql_answer = []
+            error = str(e)
+        reward_info = RewardInfo(reward=reward, info={'pred_sql': query,
+                                                    'pred_answer': pred_sql_answer})
+        if error:
+            reward_info.info['error'] = error
+        return reward_info
+
     def calculate_reward_sql(self) -> RewardInfo:
 
         if self.task.gold_sql is None:
             return RewardInfo(reward=None, info={'pred_sql': None, 'pred_answer': None})
 
-        reward = 0.0
-
         # Find the SQL actions
-        curr_sql = None
-        for action in self.actions:
-            if action.name == 'sql_db_query':
-                curr_sql = action
-            if curr_sql:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-
-                try:
-                    gold_answer = process_result(self.task.gold_answer)
-                    cursor.execute(curr_sql.kwargs["query"])
-                    pred_sql_answer = cursor.fetchall()
-                    pred_sql_answer = process_result(pred_sql_answer)
-                    # returning a single column
-                    if pred_sql_answer and len(pred_sql_answer) > 0:
-                        if len(pred_sql_answer[0]) == 1:
-                            if pred_sql_answer == gold_answer:
-                                reward = 1.0
-                        # returning multiple columns
-                        else:
-                            converted_pred_sql_answer = list(zip(*pred_sql_answer))
-                            for i in range(len(converted_pred_sql_answer)):
-                                if sorted(set([r for r in converted_pred_sql_answer[i] if r != 'None'])) == sorted(set([el[0] for el in gold_answer])):
-                                    reward = 1.0
-                                    break
-                except sqlite3.Error as e:
-                    pred_sql_answer = []
-                conn.close()
-                reward_info = RewardInfo(reward=reward, info={'pred_sql': curr_sql.kwargs["query"],
-                                                            'pred_answer': pred_sql_answer})
-                if reward > 0:
-                    return reward_info
-            else:
-                reward_info = RewardInfo(reward=reward, info={'pred_sql': None,
-                                                        'pred_answer': None})
-        return reward_info
\ No newline at end of file
+        queries = [action.kwargs["query"] for action in self.actions if action.name == 'sql_db_query']
+        if not queries:
+            return RewardInfo(reward=0.0, info={'pred_sql': None, 'pred_answer': None})
+
+        # The first query (in conversation order) that earns the reward wins; otherwise the last one is reported.
+        # Each distinct query is executed at most once, all on one read-only connection.
+        scored: Dict[str, RewardInfo] = {}
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        try:
+            for query in queries:
+                if query not in scored:
+                    scored[query] = self.score_sql(query, conn)
+                if scored[query].reward > 0:
+                    return scored[query]
+        finally:
+            conn.close()
+        return scored[queries[-1]]
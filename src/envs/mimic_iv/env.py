@@ -1,11 +1,16 @@
 import os
 import json
+from typing import Optional
 from src.types import Task
+from src.utils import DEFAULT_QUERY_TIMEOUT
 from src.envs.base import Env
 from src.envs.mimic_iv.tools.sql_db_list_tables import SqlDbListTables
 from src.envs.mimic_iv.tools.sql_db_schema import SqlDbSchema
 from src.envs.mimic_iv.tools.sql_db_query import SqlDbQuery
 from src.envs.mimic_iv.tools.value_substring_search import ValueSubstringSearch
+from src.envs.mimic_iv.tools.value_index import ValueIndex
+from src.envs.mimic_iv.tools.value_fuzzy_search import ValueFuzzySearch
+from src.envs.mimic_iv.tools.schema_digest import shared_schema_digest
 # TODO: import your own tools here
 from src.envs.mimic_iv.tools.instruction_sql_search import InstructionSQLSearch
 from sqlalchemy import create_engine
@@ -20,6 +25,11 @@ class MimicIVEnv(Env):
         user_model: str,
         task_index: int,
         db_path: str = "src/envs/mimic_iv/mimic_iv.sqlite",
+        use_value_index: bool = False,
+        query_timeout: Optional[float] = DEFAULT_QUERY_TIMEOUT,
+        query_max_steps: Optional[int] = None,
+        schema_digest_tokens: Optional[int] = None,
+        instruction_index: str = "flat",
     ):
         assert os.path.exists(db_path), f"Database file does not exist: {db_path}"
         with open(os.path.join(FOLDER_PATH, f"{eval_mode}_data.json"), "r") as f:
@@ -29,15 +39,19 @@ class MimicIVEnv(Env):
         engine = create_engine(f"sqlite:///{db_path}")
         sql_db_list_tables = SqlDbListTables(engine=engine)
         sql_db_schema = SqlDbSchema(engine=engine)
-        sql_db_query = SqlDbQuery(engine=engine)
-        value_substring_search = ValueSubstringSearch(engine=engine)
-        instruction_sql_search = InstructionSQLSearch()
+        sql_db_query = SqlDbQuery(engine=engine, timeout=query_timeout, max_steps=query_max_steps)
+        value_index = ValueIndex.shared(db_path) if use_value_index else None
+        value_substring_search = ValueSubstringSearch(engine=engine, value_index=value_index)
+        value_fuzzy_search = ValueFuzzySearch(engine=engine, value_index=value_index)
+        instruction_sql_search = InstructionSQLSearch.shared(instruction_index)
+        schema_digest = shared_schema_digest(db_path, schema_digest_tokens, value_index) if schema_digest_tokens else None
 
         super().__init__(
             tools=[
                 sql_db_list_tables,
                 sql_db_schema,
                 value_substring_search,
+                value_fuzzy_search,
                 sql_db_query,
                 # TODO: add your own tools here
                 instruction_sql_search,
@@ -48,4 +62,7 @@ class MimicIVEnv(Env):
             db_path=db_path,
             task_index=task_index,
             rule=rule,
+            query_timeout=query_timeout,
+            query_max_steps=query_max_steps,
+            schema_digest=schema_digest,
         )
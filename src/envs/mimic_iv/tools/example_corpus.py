@@ -0,0 +1,110 @@
+import os
+import json
+import hashlib
+import sqlite3
+from contextlib import closing
+from typing import Dict, List, Optional, Sequence
+
+from src.utils import ReadOnlyConnections, atomic_write, db_fingerprint
+
+BASE_DATA_DIR = 'src/envs/mimic_iv'
+MIMIC_TRAIN_DATA_PATH = os.path.join(BASE_DATA_DIR, 'mimic_train_data.json')
+MIMIC_TRAIN_LABEL_PATH = os.path.join(BASE_DATA_DIR, 'mimic_train_label.json')
+MIMIC_VALID_DATA_PATH = os.path.join(BASE_DATA_DIR, 'mimic_valid_data.json')
+MIMIC_VALID_LABEL_PATH = os.path.join(BASE_DATA_DIR, 'mimic_valid_label.json')
+SOURCE_PATHS = (MIMIC_TRAIN_DATA_PATH, MIMIC_TRAIN_LABEL_PATH, MIMIC_VALID_DATA_PATH, MIMIC_VALID_LABEL_PATH)
+CACHE_DIR = os.path.join(BASE_DATA_DIR, '.cache')
+
+
+def load_examples() -> List[Dict]:
+    """Load the train+valid instruction-SQL pairs, skipping unanswerable ones."""
+    with open(os.path.join(MIMIC_TRAIN_DATA_PATH), 'r') as f:
+        mimic_train_data = json.load(f)
+        
+    with open(os.path.join(MIMIC_TRAIN_LABEL_PATH), 'r') as f:
+        mimic_train_label = json.load(f)
+        
+    with open(os.path.join(MIMIC_VALID_DATA_PATH), 'r') as f:
+        mimic_valid_data = json.load(f)
+        
+    with open(os.path.join(MIMIC_VALID_LABEL_PATH), 'r') as f:
+        mimic_valid_label = json.load(f)
+        
+    total_data = mimic_train_data['data'] + mimic_valid_data['data']
+    total_label = {}
+    total_label.update(mimic_train_label)
+    total_label.update(mimic_valid_label)
+    
+    data = []
+    for sample in total_data:
+        sample_id = sample['id']
+        sample_question = sample['question']
+        sample_label = total_label[sample_id]
+        if sample_label == "null":
+            continue
+        sample_dict = {"id": sample_id, "question": sample_question, "label": sample_label}
+        data.append(sample_dict)
+    return data
+
+
+def corpus_hash(ids: Sequence[str], questions: Sequence[str]) -> str:
+    """Hash of the (id, question) corpus, used to key derived artifacts such as embeddings."""
+    h = hashlib.sha256()
+    for sample_id, question in zip(ids, questions):
+        h.update(sample_id.encode('utf-8') + b'\0')
+        h.update(question.encode('utf-8') + b'\0')
+    return h.hexdigest()[:16]
+
+
+class ExampleCorpus:
+    """The instruction-SQL examples in a compact SQLite file, built once from the JSON sources.
+
+    Opening it only reads a few metadata rows; full records are materialised for the positions a search
+    returns, and whole columns only when a retriever index has to be (re)built.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        source_key = hashlib.sha256("|".join(db_fingerprint(p) for p in SOURCE_PATHS).encode()).hexdigest()[:16]
+        self.path = path or os.path.join(CACHE_DIR, f"instruction_corpus_{source_key}.sqlite")
+        if not os.path.exists(self.path):
+            self._build()
+        self._connections = ReadOnlyConnections(self.path)
+        meta = dict(self._connections.get().execute("SELECT key, value FROM meta"))
+        self.key = meta['corpus_hash']
+        self.size = int(meta['size'])
+
+    def _build(self) -> None:
+        data = load_examples()
+
+        def write(tmp_path: str) -> None:
+            with closing(sqlite3.connect(tmp_path)) as conn:
+                conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+                conn.execute("CREATE TABLE examples (pos INTEGER PRIMARY KEY, id TEXT, question TEXT, label TEXT)")
+                conn.executemany(
+                    "INSERT INTO examples VALUES (?, ?, ?, ?)",
+                    [(i, d['id'], d['question'], d['label']) for i, d in enumerate(data)],
+                )
+                key = corpus_hash([d['id'] for d in data], [d['question'] for d in data])
+                conn.executemany("INSERT INTO meta VALUES (?, ?)", [('corpus_hash', key), ('size', str(len(data)))])
+                conn.commit()
+        atomic_write(self.path, write)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def column(self, name: str) -> List[str]:
+        """Every value of `id`, `question` or `label`, in corpus order."""
+        if name not in ('id', 'question', 'label'):
+            raise ValueError(f"Unknown column '{name}'")
+        return [row[0] for row in self._connections.get().execute(f"SELECT {name} FROM examples ORDER BY pos")]
+
+    def get(self, positions: Sequence[int]) -> List[Dict]:
+        """The examples at `positions`, in that order."""
+        if not positions:
+            return []
+        placeholders = ",".join("?" * len(positions))
+        rows = self._connections.get().execute(
+            f"SELECT pos, id, question, label FROM examples WHERE pos IN ({placeholders})", [int(p) for p in positions]
+        )
+        by_pos = {pos: {"id": id_, "question": question, "label": label} for pos, id_, question, label in rows}
+        return [by_pos[int(p)] for p in positions]
@@ -1,95 +1,73 @@
-import os
-import json
-import faiss
+import threading
 
-from typing import Any, Dict, List
-from pydantic import BaseModel
-from sentence_transformers import SentenceTransformer
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel, PrivateAttr
+
+from src.envs.mimic_iv.tools.example_corpus import ExampleCorpus
+from src.envs.mimic_iv.tools.retrievers import RETRIEVER_TYPES, Retriever, build_retriever
+
+DEFAULT_K = 10
+# MMR already spreads the hybrid results over distinct query patterns, so a few examples cover them.
+HYBRID_DEFAULT_K = 5
+
+_shared_instances: Dict[str, "InstructionSQLSearch"] = {}
+_shared_lock = threading.Lock()
 
-BASE_DATA_DIR = 'src/envs/mimic_iv'
-MIMIC_TRAIN_DATA_PATH = os.path.join(BASE_DATA_DIR, 'mimic_train_data.json')
-MIMIC_TRAIN_LABEL_PATH = os.path.join(BASE_DATA_DIR, 'mimic_train_label.json')
-MIMIC_VALID_DATA_PATH = os.path.join(BASE_DATA_DIR, 'mimic_valid_data.json')
-MIMIC_VALID_LABEL_PATH = os.path.join(BASE_DATA_DIR, 'mimic_valid_label.json')
 
 class InstructionSQLSearch(BaseModel):
-    data: List[Dict]
-    model: Any
-    index: Any
+    corpus: ExampleCorpus
+    retriever_type: str = "flat"
+    retriever: Optional[Retriever] = None
+    _retriever_lock: Any = PrivateAttr()
     
     class Config:
         arbitrary_types_allowed = True
         
-    def __init__(self):
-        with open(os.path.join(MIMIC_TRAIN_DATA_PATH), 'r') as f:
-            mimic_train_data = json.load(f)
-            
-        with open(os.path.join(MIMIC_TRAIN_LABEL_PATH), 'r') as f:
-            mimic_train_label = json.load(f)
-            
-        with open(os.path.join(MIMIC_VALID_DATA_PATH), 'r') as f:
-            mimic_valid_data = json.load(f)
-            
-        with open(os.path.join(MIMIC_VALID_LABEL_PATH), 'r') as f:
-            mimic_valid_label = json.load(f)
-            
-        total_data = mimic_train_data['data'] + mimic_valid_data['data']
-        total_label = {}
-        total_label.update(mimic_train_label)
-        total_label.update(mimic_valid_label)
-        
-        data = []
-        for sample in total_data:
-            sample_id = sample['id']
-            sample_question = sample['question']
-            sample_label = total_label[sample_id]
-            if sample_label == "null":
-                continue
-            sample_dict = {"id": sample_id, "question": sample_question, "label": sample_label}
-            data.append(sample_dict)
-        
-        # print(len(data))
-        # print(data[:5])
-            
-        # Extract the questions from the training data for embedding.
-        questions = [sample['question'] for sample in data]
-        
-        # Initialize the sentence transformer model.
-        model = SentenceTransformer('all-mpnet-base-v2')
-        
-        # Compute embeddings for each training question.
-        corpus_embeddings = model.encode(questions, convert_to_numpy=True)
-        
-        # Build a FAISS index using L2 similarity.
-        embedding_dim = corpus_embeddings.shape[1]
-        
-        index = faiss.IndexFlatL2(embedding_dim)
-        index.add(corpus_embeddings)  # Add the embeddings to the index.
-        
-        super().__init__(data=data, model=model, index=index)
-    
-    def invoke(self, instruction: str, k: int = 10) -> str:
-        # Compute embedding for the new user query.
-        query_embedding = self.model.encode([instruction], convert_to_numpy=True)
-        
-        # Search the FAISS index for the most similar questions.
-        distances, indices = self.index.search(query_embedding, k)
-        
-        results = []
-        for idx in indices[0]:
-            # Get the corresponding training example.
-            data_entry = self.data[idx]
-            
-            # Append the combined result.
-            results.append(data_entry)
+    def __init__(self, retriever_type: str = "flat"):
+        if retriever_type not in RETRIEVER_TYPES:
+            raise ValueError(f"Unknown retriever '{retriever_type}', expected one of {RETRIEVER_TYPES}")
+        super().__init__(corpus=ExampleCorpus(), retriever_type=retriever_type)
+        self._retriever_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, retriever_type: str = "flat") -> "InstructionSQLSearch":
+        """Return the process-wide instance for `retriever_type`, building it on first use."""
+        instance = _shared_instances.get(retriever_type)
+        if instance is None:
+            with _shared_lock:
+                instance = _shared_instances.get(retriever_type)
+                if instance is None:
+                    instance = _shared_instances[retriever_type] = cls(retriever_type)
+        return instance
+
+    def get_retriever(self) -> Retriever:
+        # Built on first search, so envs whose agent never calls this tool never load an index or model.
+        if self.retriever is None:
+            with self._retriever_lock:
+                if self.retriever is None:
+                    self.retriever = build_retriever(self.retriever_type, self.corpus)
+        return self.retriever
+
+    @property
+    def default_k(self) -> int:
+        return HYBRID_DEFAULT_K if self.retriever_type == "hybrid" else DEFAULT_K
+
+    def search_many(self, instructions: List[str], k: Optional[int] = None) -> List[List[Dict]]:
+        """The k most similar training examples for each instruction, searched as one batch."""
+        if k is None:
+            k = self.default_k
+        if not instructions or k <= 0:
+            return [[] for _ in instructions]
+        # Only the returned examples are read from the corpus.
+        return [self.corpus.get(row) for row in self.get_retriever().search_many(instructions, k)]
 
+    def invoke(self, instruction: str, k: Optional[int] = None) -> str:
         answer = ""
-        for r in results:
+        for r in self.search_many([instruction], k)[0]:
             answer += f"NLQ:{r['question']}\nSQL:{r['label']}\n"
         return answer
 
-    @staticmethod
-    def get_info() -> Dict[str, Any]:
+    def get_info(self) -> Dict[str, Any]:
         return {
             "type": "function",
             "function": {
@@ -104,7 +82,7 @@ class InstructionSQLSearch(BaseModel):
                         },
                         "k": {
                             "type": "integer",
-                            "description": "The maximum number of values to return. Default is 10."
+                            "description": f"The maximum number of values to return. Default is {self.default_k}."
                         }
                     },
                     "required": ["query"]
@@ -113,10 +91,10 @@ class InstructionSQLSearch(BaseModel):
         }
 
 if __name__ == "__main__":
-    instruction_sql_search = InstructionSQLSearch()
+    instruction_sql_search = InstructionSQLSearch.shared()
     print("Initialized")
-    print(len(instruction_sql_search.data))
-    print(instruction_sql_search.data[:5])
+    print(len(instruction_sql_search.corpus))
+    print(instruction_sql_search.corpus.get(range(5)))
     
     print(instruction_sql_search.invoke('What are the ways to consume sodium bicarbonate?'))
     
\ No newline at end of file
@@ -0,0 +1,284 @@
+import abc
+import os
+import re
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from src.envs.mimic_iv.tools.example_corpus import CACHE_DIR, ExampleCorpus
+from src.utils import atomic_write
+
+# faiss and sentence_transformers (and with it torch) are imported only when they are actually used.
+
+MODEL_NAME = 'all-mpnet-base-v2'
+
+# "flat" is exact L2 search over the memory-mapped embeddings; "hnsw" and "ivf" are approximate FAISS indexes
+# (cosine similarity) that keep query latency flat as the corpus grows.
+DENSE_INDEX_TYPES = ("flat", "hnsw", "ivf")
+RETRIEVER_TYPES = DENSE_INDEX_TYPES + ("bm25", "hybrid")
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+IVF_NPROBE = 16
+QUERY_CACHE_SIZE = 1024
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Hybrid retrieval: candidates taken from each ranking, reciprocal-rank-fusion constant and MMR trade-off.
+HYBRID_POOL = 50
+RRF_K = 60
+MMR_LAMBDA = 0.7
+
+_SQL_STRING = re.compile(r"'(?:[^']|'')*'")
+_SQL_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SQL_TOKEN = re.compile(r"[a-z_][a-z0-9_]*|[<>=!]+|\*|\(|\)")
+
+
+def sql_skeleton(sql: str) -> List[str]:
+    """Tokens of a query with its literals replaced by placeholders; tables, columns, joins and aggregates are kept."""
+    sql = _SQL_STRING.sub(" 'val' ", sql.lower())
+    sql = _SQL_NUMBER.sub(" 0 ", sql)
+    return _SQL_TOKEN.findall(sql.replace("'val'", " val ").replace(" 0 ", " num "))
+
+
+class Retriever(abc.ABC):
+    """Ranks the questions of a fixed corpus by similarity to free-text queries."""
+
+    @abc.abstractmethod
+    def search_many(self, queries: List[str], k: int) -> List[List[int]]:
+        """Corpus positions of the (up to) k best matches for each query, best first."""
+        raise NotImplementedError
+
+
+class BM25Retriever(Retriever):
+    """Okapi BM25 over lower-cased word tokens, in plain NumPy (no model download, no torch)."""
+
+    def __init__(self, questions: List[str], k1: float = BM25_K1, b: float = BM25_B) -> None:
+        self.k1 = k1
+        self.b = b
+        docs = [self.tokenize(q) for q in questions]
+        self.num_docs = len(docs)
+        doc_len = np.array([len(d) for d in docs], dtype=np.float32)
+        avg_len = float(doc_len.mean()) if len(docs) and doc_len.mean() > 0 else 1.0
+        norm = k1 * (1 - b + b * doc_len / avg_len)
+        # Inverted index: term -> (document positions, precomputed BM25 term weights).
+        postings: Dict[str, List] = {}
+        for i, doc in enumerate(docs):
+            for term, tf in Counter(doc).items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(i)
+                postings[term][1].append(tf)
+        self.postings: Dict[str, tuple] = {}
+        for term, (doc_ids, tfs) in postings.items():
+            doc_ids = np.array(doc_ids, dtype=np.int64)
+            tfs = np.array(tfs, dtype=np.float32)
+            idf = np.log(1 + (self.num_docs - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+            self.postings[term] = (doc_ids, (idf * tfs * (k1 + 1) / (tfs + norm[doc_ids])).astype(np.float32))
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return re.findall(r"[a-z0-9]+", text.lower())
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for term in set(self.tokenize(query)):
+            if term in self.postings:
+                doc_ids, weights = self.postings[term]
+                scores[doc_ids] += weights
+        return scores
+
+    def search_many(self, queries: List[str], k: int) -> List[List[int]]:
+        if k <= 0:
+            return [[] for _ in queries]
+        results = []
+        for query in queries:
+            scores = self.scores(query)
+            top = np.argpartition(-scores, k - 1)[:k] if k < self.num_docs else np.arange(self.num_docs)
+            # Ties are broken by corpus position so results are deterministic.
+            results.append(sorted(top.tolist(), key=lambda i: (-scores[i], i)))
+        return results
+
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return np.ascontiguousarray(embeddings / np.maximum(norms, 1e-12), dtype=np.float32)
+
+
+class DenseRetriever(Retriever):
+    """Nearest-neighbour search over sentence embeddings.
+
+    The embeddings are a memory-mapped .npy file shared through the page cache by every worker.
+    "flat" ranks it by L2 distance on the raw vectors, like the original IndexFlatL2; "hnsw"/"ivf" load
+    a FAISS inner-product index built from the L2-normalized vectors (cosine similarity).
+    """
+
+    def __init__(self, corpus: ExampleCorpus, index_type: str = "flat", model_name: str = MODEL_NAME) -> None:
+        if index_type not in DENSE_INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{index_type}', expected one of {DENSE_INDEX_TYPES}")
+        self.corpus = corpus
+        self.index_type = index_type
+        self.model_name = model_name
+        self.hash = hashlib.sha256(f"{model_name}|{corpus.key}".encode()).hexdigest()[:16]
+        self.model: Any = None
+        self._model_lock = threading.Lock()
+        self._query_cache: OrderedDict = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        self.embeddings = self.load_or_encode_corpus()
+        if index_type == "flat":
+            self.index = None
+            self.squared_norms = np.einsum('ij,ij->i', self.embeddings, self.embeddings)
+        else:
+            self.index = self.load_or_build_index()
+
+    def get_model(self) -> Any:
+        # The encoder is only needed for queries (and for encoding the corpus on a cache miss),
+        # so it is loaded lazily on first use.
+        if self.model is None:
+            with self._model_lock:
+                if self.model is None:
+                    from sentence_transformers import SentenceTransformer
+                    self.model = SentenceTransformer(self.model_name)
+        return self.model
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(self.get_model().encode(texts, convert_to_numpy=True), dtype=np.float32)
+
+    def load_or_encode_corpus(self) -> np.ndarray:
+        """Raw corpus embeddings (memory-mapped), encoded and persisted on first use."""
+        embeddings_path = os.path.join(CACHE_DIR, f"instruction_embeddings_raw_{self.hash}.npy")
+        if not os.path.exists(embeddings_path):
+            corpus_embeddings = self.encode(self.corpus.column('question'))
+
+            def write(tmp_path: str) -> None:
+                with open(tmp_path, 'wb') as f:
+                    np.save(f, corpus_embeddings)
+            atomic_write(embeddings_path, write)
+        return np.load(embeddings_path, mmap_mode='r')
+
+    def build_index(self, embeddings: np.ndarray) -> Any:
+        import faiss
+        embedding_dim = embeddings.shape[1]
+        if self.index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(embedding_dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        else:
+            # ~4*sqrt(n) lists is the usual starting point; each list still needs enough points to train on.
+            nlist = max(1, min(int(4 * np.sqrt(len(embeddings))), len(embeddings) // 39))
+            quantizer = faiss.IndexFlatIP(embedding_dim)
+            index = faiss.IndexIVFFlat(quantizer, embedding_dim, nlist, faiss.METRIC_INNER_PRODUCT)
+            index.train(embeddings)
+        index.add(embeddings)
+        return index
+
+    def load_or_build_index(self) -> Any:
+        """Load the persisted index for this corpus and index type, building and saving it on a cache miss."""
+        import faiss
+        index_path = os.path.join(CACHE_DIR, f"instruction_index_{self.hash}_{self.index_type}.faiss")
+        if os.path.exists(index_path):
+            index = faiss.read_index(index_path)
+        else:
+            index = self.build_index(normalize(self.embeddings))
+            atomic_write(index_path, lambda tmp_path: faiss.write_index(index, tmp_path))
+        # Query-time parameters are not persisted with the index.
+        if isinstance(index, faiss.IndexHNSW):
+            index.hnsw.efSearch = HNSW_EF_SEARCH
+        elif isinstance(index, faiss.IndexIVF):
+            index.nprobe = min(IVF_NPROBE, index.nlist)
+        return index
+
+    def embed(self, queries: List[str]) -> np.ndarray:
+        """Raw query embeddings; repeated queries are served from an LRU cache."""
+        vectors: List[Optional[np.ndarray]] = []
+        with self._query_cache_lock:
+            for query in queries:
+                vector = self._query_cache.get(query)
+                if vector is not None:
+                    self._query_cache.move_to_end(query)
+                vectors.append(vector)
+        missing = list(dict.fromkeys(q for q, v in zip(queries, vectors) if v is None))
+        if missing:
+            # Encode every new query in one batch.
+            new = dict(zip(missing, self.encode(missing)))
+            with self._query_cache_lock:
+                for query, vector in new.items():
+                    self._query_cache[query] = vector
+                    self._query_cache.move_to_end(query)
+                while len(self._query_cache) > QUERY_CACHE_SIZE:
+                    self._query_cache.popitem(last=False)
+            vectors = [v if v is not None else new[q] for q, v in zip(queries, vectors)]
+        return np.stack(vectors)
+
+    def search_many(self, queries: List[str], k: int) -> List[List[int]]:
+        if k <= 0:
+            return [[] for _ in queries]
+        queries_embeddings = self.embed(queries)
+        if self.index is None:
+            # Squared L2 distance up to the per-query constant |q|^2, which does not change the ranking.
+            distances = self.squared_norms - 2 * (queries_embeddings @ self.embeddings.T)
+            results = []
+            for row in distances:
+                top = np.argpartition(row, k - 1)[:k] if k < len(row) else np.arange(len(row))
+                results.append(sorted(top.tolist(), key=lambda i: (row[i], i)))
+            return results
+        _scores, indices = self.index.search(normalize(queries_embeddings), k)
+        # Approximate indexes pad with -1 when fewer than k neighbours are found.
+        return [[int(i) for i in row if i >= 0] for row in indices]
+
+
+class HybridRetriever(Retriever):
+    """Fuses dense question similarity with BM25 over question + SQL skeleton, then de-duplicates query patterns.
+
+    The two rankings are combined with reciprocal rank fusion; results are then picked by maximal marginal
+    relevance, where redundancy is the overlap of SQL skeletons, so near-identical templates that only differ
+    in their literals do not crowd out other query patterns.
+    """
+
+    def __init__(self, corpus: ExampleCorpus, dense: Optional[Retriever] = None, lexical: Optional[Retriever] = None) -> None:
+        skeletons = [sql_skeleton(sql) for sql in corpus.column('label')]
+        self.lexical = lexical or BM25Retriever([f"{q} {' '.join(skel)}" for q, skel in zip(corpus.column('question'), skeletons)])
+        self.dense = dense or DenseRetriever(corpus, "flat")
+        # Unigrams and bigrams, so skeletons with the same tables but a different structure still differ.
+        self.patterns = [frozenset(skel) | frozenset(zip(skel, skel[1:])) for skel in skeletons]
+
+    def similarity(self, i: int, j: int) -> float:
+        union = len(self.patterns[i] | self.patterns[j])
+        return len(self.patterns[i] & self.patterns[j]) / union if union else 1.0
+
+    def mmr(self, relevance: Dict[int, float], k: int) -> List[int]:
+        selected: List[int] = []
+        candidates = sorted(relevance, key=lambda i: (-relevance[i], i))
+        while candidates and len(selected) < k:
+            best = max(
+                candidates,
+                key=lambda i: MMR_LAMBDA * relevance[i] - (1 - MMR_LAMBDA) * max((self.similarity(i, j) for j in selected), default=0.0),
+            )
+            selected.append(best)
+            candidates.remove(best)
+        return selected
+
+    def search_many(self, queries: List[str], k: int) -> List[List[int]]:
+        if k <= 0:
+            return [[] for _ in queries]
+        pool = max(k, HYBRID_POOL)
+        results = []
+        for dense, lexical in zip(self.dense.search_many(queries, pool), self.lexical.search_many(queries, pool)):
+            fused: Dict[int, float] = {}
+            for ranking in (dense, lexical):
+                for rank, i in enumerate(ranking):
+                    fused[i] = fused.get(i, 0.0) + 1 / (RRF_K + rank + 1)
+            top = max(fused.values(), default=1.0)
+            results.append(self.mmr({i: score / top for i, score in fused.items()}, k))
+        return results
+
+
+def build_retriever(retriever_type: str, corpus: ExampleCorpus) -> Retriever:
+    """Retriever over the questions of `corpus`."""
+    if retriever_type == "bm25":
+        return BM25Retriever(corpus.column('question'))
+    if retriever_type in DENSE_INDEX_TYPES:
+        return DenseRetriever(corpus, retriever_type)
+    if retriever_type == "hybrid":
+        return HybridRetriever(corpus)
+    raise ValueError(f"Unknown retriever '{retriever_type}', expected one of {RETRIEVER_TYPES}")
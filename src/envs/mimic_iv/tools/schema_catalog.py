@@ -0,0 +1,107 @@
+import os
+import sqlite3
+import threading
+from contextlib import closing
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from src.utils import db_fingerprint
+
+_shared_catalogs: Dict[str, "SchemaCatalog"] = {}
+_shared_lock = threading.Lock()
+
+
+class TableInfo(BaseModel):
+    # PRAGMA table_info rows: (cid, name, type, notnull, dflt_value, pk)
+    columns: List[Tuple]
+    # PRAGMA foreign_key_list rows: (id, seq, table, from, to, on_update, on_delete, match)
+    foreign_keys: List[Tuple]
+    unique_columns: List[str]
+    samples: List[Tuple]
+
+
+class SchemaCatalog:
+    """Schema and sample rows of every table, read once per database file.
+
+    The database is read-only during evaluation, so the catalogue is shared across env instances
+    and only re-read when the file's size or mtime changes.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+        self.fingerprint = db_fingerprint(db_path)
+        self.tables: Dict[str, TableInfo] = {}
+        with closing(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)) as conn:
+            self.table_names: List[str] = [row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite~_%' ESCAPE '~' ORDER BY name"
+            )]
+            for table in self.table_names:
+                self.tables[table.lower()] = self._read_table(conn, table)
+
+    @classmethod
+    def shared(cls, db_path: str) -> "SchemaCatalog":
+        key = os.path.abspath(db_path)
+        with _shared_lock:
+            catalog = _shared_catalogs.get(key)
+            if catalog is None or catalog.fingerprint != db_fingerprint(db_path):
+                catalog = _shared_catalogs[key] = cls(db_path)
+            return catalog
+
+    @staticmethod
+    def _read_table(conn: sqlite3.Connection, table: str) -> TableInfo:
+        columns = [tuple(row) for row in conn.execute(f"PRAGMA table_info('{table}');")]
+        foreign_keys = [tuple(row) for row in conn.execute(f"PRAGMA foreign_key_list('{table}');")]
+        # PRAGMA index_list returns: (seq, name, unique, origin, partial)
+        # We're filtering for those with origin 'u'
+        unique_keys = [row[1] for row in conn.execute(f"PRAGMA index_list('{table}');") if row[3] == 'u']
+        unique_columns = []
+        for key in unique_keys:
+            index_info = [tuple(row) for row in conn.execute(f"PRAGMA index_info('{key}');")]
+            if index_info:
+                unique_columns.append(index_info[0][2])  # third element is the column name
+        samples = [tuple(row) for row in conn.execute(f'SELECT * FROM "{table}" LIMIT 3;')]
+        return TableInfo(columns=columns, foreign_keys=foreign_keys, unique_columns=unique_columns, samples=samples)
+
+    def get_table(self, table: str) -> Optional[TableInfo]:
+        return self.tables.get(table.lower())
+
+    def render_table(self, table: str) -> Optional[str]:
+        """CREATE TABLE statement plus 3 sample rows, as shown by sql_db_schema; None if unknown."""
+        info = self.get_table(table)
+        if info is None:
+            return None
+
+        # Build schema string for the table
+        schema_str = f"CREATE TABLE {table} ("
+        columns_list = []
+        for col in info.columns:
+            col_name = col[1]
+            col_type = col[2].upper().replace("INT", "INTEGER") if col[2] else ""
+            if 'TIMESTAMP' in col_type:
+                col_type = 'TIMESTAMP'
+            not_null = "NOT NULL" if col[3] else ""
+            columns_list.append(f"\n\t{col_name} {col_type} {not_null}".rstrip())
+        schema_str += ",".join(columns_list)
+
+        # Add primary keys if defined
+        primary_keys = [col[1] for col in info.columns if col[5]]
+        if primary_keys:
+            schema_str += f",\n\tPRIMARY KEY ({', '.join(primary_keys)})"
+
+        # Add foreign keys
+        for fk in info.foreign_keys:
+            schema_str += f",\n\tFOREIGN KEY ({fk[3]}) REFERENCES {fk[2]} ({fk[4]})"
+
+        # Add unique constraints
+        for unique_col in info.unique_columns:
+            schema_str += f",\n\tUNIQUE ({unique_col})"
+
+        schema_str = schema_str.rstrip(',\n') + '\n)'
+
+        # Build sample rows string
+        column_names = [col[1] for col in info.columns]
+        sample_rows_str = f"\n/*\n3 rows from {table} table:\n" + "\t".join(column_names) + "\n"
+        sample_rows_str += "\n".join(["\t".join(map(str, row)) for row in info.samples]) + "\n*/"
+
+        return schema_str + sample_rows_str
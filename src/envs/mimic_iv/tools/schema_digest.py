@@ -0,0 +1,100 @@
+import os
+import sqlite3
+import threading
+from contextlib import closing
+from typing import Dict, List, Optional, Tuple
+
+from src.envs.mimic_iv.tools.schema_catalog import SchemaCatalog
+from src.envs.mimic_iv.tools.value_index import TEXT_TYPES
+from src.utils import QueryTimeoutError, db_fingerprint, estimate_tokens, sql_query_budget
+
+DEFAULT_DIGEST_TOKENS = 3000
+# Columns with at most this many distinct values list them in the digest.
+MAX_LISTED_VALUES = 10
+MAX_VALUE_CHARS = 40
+# Finding the distinct values of a column in a large table must not stall env construction.
+VALUE_QUERY_TIMEOUT = 2.0
+OMITTED_NOTE = "(more tables omitted; use sql_db_list_tables and sql_db_schema)"
+
+_digests: Dict[Tuple[str, str, int], str] = {}
+_digests_lock = threading.Lock()
+
+
+def low_cardinality_values(conn: sqlite3.Connection, table: str, column: str, value_index=None) -> Optional[List[str]]:
+    """Distinct values of table.column if there are at most MAX_LISTED_VALUES of them, else None."""
+    if value_index is not None and value_index.has_column(table, column):
+        rows = [(v,) for v in value_index.values(table, column, MAX_LISTED_VALUES + 1)]
+    else:
+        try:
+            with sql_query_budget(conn, timeout=VALUE_QUERY_TIMEOUT):
+                rows = conn.execute(
+                    f'SELECT DISTINCT "{column}" FROM "{table}" WHERE "{column}" IS NOT NULL LIMIT {MAX_LISTED_VALUES + 1}'
+                ).fetchall()
+        except (QueryTimeoutError, sqlite3.Error):
+            return None
+    if not rows or len(rows) > MAX_LISTED_VALUES:
+        return None
+    return sorted(str(row[0])[:MAX_VALUE_CHARS] for row in rows)
+
+
+def render_digest(catalog: SchemaCatalog, values: Dict[Tuple[str, str], List[str]], detail: int) -> str:
+    """One line per table, then its foreign keys.
+
+    detail 2: column types, keys and listed values; 1: without values; 0: column names and keys only.
+    """
+    lines = []
+    for table in catalog.table_names:
+        info = catalog.get_table(table)
+        columns = []
+        for col in info.columns:
+            # PRAGMA table_info rows: (cid, name, type, notnull, dflt_value, pk)
+            column = col[1]
+            if detail >= 1 and col[2]:
+                column += f" {col[2].upper()}"
+            if col[5]:
+                column += " PK"
+            if detail >= 2 and (table, col[1]) in values:
+                column += " " + repr(values[(table, col[1])])
+            columns.append(column)
+        lines.append(f"{table}({', '.join(columns)})")
+        for fk in info.foreign_keys:
+            # PRAGMA foreign_key_list rows: (id, seq, table, from, to, on_update, on_delete, match)
+            lines.append(f"  {table}.{fk[3]} -> {fk[2]}.{fk[4]}")
+    return "\n".join(lines)
+
+
+def build_schema_digest(db_path: str, token_budget: int = DEFAULT_DIGEST_TOKENS, value_index=None) -> str:
+    """Compact description of every table of the database that fits in `token_budget` tokens.
+
+    Detail is dropped (listed values first, then column types) until the digest fits; if even
+    the plainest form does not, trailing tables are cut and the agent is pointed to the schema tools.
+    """
+    catalog = SchemaCatalog.shared(db_path)
+    values = {}
+    with closing(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)) as conn:
+        for table in catalog.table_names:
+            for col in catalog.get_table(table).columns:
+                if any(t in (col[2] or "").upper() for t in TEXT_TYPES):
+                    listed = low_cardinality_values(conn, table, col[1], value_index)
+                    if listed:
+                        values[(table, col[1])] = listed
+
+    for detail in (2, 1, 0):
+        digest = render_digest(catalog, values, detail)
+        if estimate_tokens([{"content": digest}]) <= token_budget:
+            return digest
+    # The pointer to the schema tools counts against the budget too.
+    lines = digest.split("\n") + [OMITTED_NOTE]
+    while len(lines) > 1 and estimate_tokens([{"content": "\n".join(lines)}]) > token_budget:
+        lines.pop(-2)
+    return "\n".join(lines)
+
+
+def shared_schema_digest(db_path: str, token_budget: int = DEFAULT_DIGEST_TOKENS, value_index=None) -> str:
+    """Build the digest once per database file and budget, and reuse it for every env instance."""
+    key = (os.path.abspath(db_path), db_fingerprint(db_path), token_budget)
+    with _digests_lock:
+        digest = _digests.get(key)
+        if digest is None:
+            digest = _digests[key] = build_schema_digest(db_path, token_budget, value_index)
+        return digest
@@ -1,7 +1,8 @@
 from typing import Dict, Any
 from pydantic import BaseModel, Field
 from sqlalchemy.engine import Engine
-from sqlalchemy import inspect
+
+from src.envs.mimic_iv.tools.schema_catalog import SchemaCatalog
 
 class SqlDbListTables(BaseModel):
     engine: Engine = Field(..., description="The engine to list tables from.")
@@ -10,9 +11,8 @@ class SqlDbListTables(BaseModel):
         arbitrary_types_allowed = True
 
     def invoke(self, tool_input: str = "") -> str:
-        inspector = inspect(self.engine)
-        tables = inspector.get_table_names()
-        return ", ".join(tables)
+        catalog = SchemaCatalog.shared(self.engine.url.database)
+        return ", ".join(catalog.table_names)
 
     @staticmethod
     def get_info() -> Dict[str, Any]:
@@ -1,29 +1,65 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from sqlalchemy import text
 from sqlalchemy.engine import Engine
 from sqlalchemy.exc import SQLAlchemyError
 from pydantic import BaseModel, Field
 
+from src.utils import DEFAULT_QUERY_TIMEOUT, QueryTimeoutError, sql_query_budget
+from src.envs.query_cache import get_query_cache
+
+COUNT_CHUNK_SIZE = 1000
+# Results with more rows are not cached: the cache is bounded by entries, so a few huge results could pin gigabytes.
+MAX_CACHED_ROWS = 1000
+
 class SqlDbQuery(BaseModel):
     engine: Engine = Field(..., description="The engine to execute queries on.")
+    count_limit: int = Field(10000, description="Rows counted for the 'results not shown' note before reporting 'more than'.")
+    timeout: Optional[float] = Field(DEFAULT_QUERY_TIMEOUT, description="Wall-clock budget per query in seconds (None to disable).")
+    max_steps: Optional[int] = Field(None, description="SQLite VM-step budget per query (None to disable).")
 
     class Config:
         arbitrary_types_allowed = True
 
     def invoke(self, query: str, k: int = 100) -> str:
         result = ""
+        cache = get_query_cache()
+        db_path = self.engine.url.database
+        response_key = cache.make_key(db_path, "sql_db_query", query, k, self.count_limit)
+        cached = cache.get(response_key)
+        if cached is not None:
+            return cached
         try:
-            with self.engine.connect() as conn:
-                result = conn.execute(text(query))
-                result = result.fetchall()
-            n = len(result)
-            base_response = str(result[:k])
-            if n > k:
+            with self.engine.connect() as conn, \
+                    sql_query_budget(conn.connection.dbapi_connection, self.timeout, self.max_steps):
+                cursor = conn.execute(text(query))
+                # Stream rows: only the first k are materialised, the rest are counted and dropped.
+                result = cursor.fetchmany(k) if k > 0 else []
+                n = len(result)
+                capped = False
+                if n == max(k, 0):
+                    while n < self.count_limit:
+                        chunk = cursor.fetchmany(min(COUNT_CHUNK_SIZE, self.count_limit - n))
+                        if not chunk:
+                            break
+                        n += len(chunk)
+                    capped = n >= self.count_limit and cursor.fetchone() is not None
+            cacheable = len(result) <= MAX_CACHED_ROWS
+            if n == len(result) and cacheable:
+                # The complete result was fetched, so reward evaluation can reuse it without re-executing.
+                cache.put(cache.make_key(db_path, "rows", query), [tuple(row) for row in result])
+            base_response = str(result)
+            if capped:
+                base_response += (
+                    f"\n\nNote: There are more than {n - len(result)} results not shown (out of more than {n} total results)."
+                )
+            elif n > k:
                 additional = n - k
                 base_response += (
                     f"\n\nNote: There are {additional} results not shown (out of {n} total results)."
                 )
-        except SQLAlchemyError as e:
+            if cacheable:
+                cache.put(response_key, base_response)
+        except (SQLAlchemyError, QueryTimeoutError) as e:
             """Format the error message"""
             base_response = f"Error: {e}"
         return base_response
@@ -0,0 +1,194 @@
+import re
+import threading
+from collections import Counter, OrderedDict
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional, Set, Tuple
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from pydantic import BaseModel, Field
+
+from src.utils import db_fingerprint, sql_query_budget
+
+# Common clinical shorthand users type instead of the stored value.
+ABBREVIATIONS = {
+    "hb": ["hemoglobin"], "hgb": ["hemoglobin"], "hct": ["hematocrit"],
+    "wbc": ["white blood cells"], "rbc": ["red blood cells"], "plt": ["platelet count"],
+    "mcv": ["mean corpuscular volume"], "mch": ["mean corpuscular hemoglobin"],
+    "na": ["sodium"], "k": ["potassium"], "cl": ["chloride"], "ca": ["calcium"],
+    "mg": ["magnesium"], "phos": ["phosphate"], "hco3": ["bicarbonate"], "bicarb": ["bicarbonate"],
+    "bun": ["urea nitrogen"], "cr": ["creatinine"], "glu": ["glucose"], "alb": ["albumin"],
+    "inr": ["inr(pt)"], "pt": ["pt", "prothrombin time"], "ptt": ["ptt", "partial thromboplastin time"],
+    "alt": ["alanine aminotransferase"], "ast": ["asparate aminotransferase", "aspartate aminotransferase"],
+    "ldh": ["lactate dehydrogenase"], "bp": ["blood pressure"], "hr": ["heart rate"],
+    "rr": ["respiratory rate"], "spo2": ["o2 saturation"], "temp": ["temperature"],
+    "asa": ["aspirin"], "apap": ["acetaminophen"], "ntg": ["nitroglycerin"],
+    "kcl": ["potassium chloride"], "nacl": ["sodium chloride"], "d5w": ["dextrose 5%"],
+    "mi": ["myocardial infarction"], "chf": ["congestive heart failure"], "htn": ["hypertension"],
+    "copd": ["chronic obstructive pulmonary disease"], "dm": ["diabetes mellitus"],
+    "afib": ["atrial fibrillation"], "uti": ["urinary tract infection"], "ckd": ["chronic kidney disease"],
+    "cad": ["coronary atherosclerosis"], "cabg": ["coronary artery bypass"], "gerd": ["esophageal reflux"],
+    "icu": ["intensive care unit"], "sicu": ["surgical intensive care unit"], "micu": ["medical intensive care unit"],
+}
+MIN_SCORE = 0.3
+# Above this many distinct values, only candidates sharing a trigram with the query are scored in full.
+FULL_SCAN_LIMIT = 5000
+MAX_CANDIDATES = 500
+# Bound the distinct values read per column (from the ValueIndex or the table) so a high-cardinality
+# column (e.g. a timestamp) cannot stall the worker or pin its whole value set in memory.
+MAX_VOCABULARY_VALUES = 50000
+VOCABULARY_QUERY_TIMEOUT = 5.0
+# Vocabularies kept in memory, least recently used evicted first.
+MAX_VOCABULARIES = 64
+
+_vocabularies: "OrderedDict[Tuple[str, str, str, str], ColumnVocabulary]" = OrderedDict()
+_vocabularies_lock = threading.Lock()
+# One lock per (db, table, column) vocabulary being built, so concurrent tool calls build it only once.
+_build_locks: Dict[Tuple[str, str, str, str], threading.Lock] = {}
+
+
+def normalize(value: str) -> str:
+    return " ".join(re.findall(r"[a-z0-9]+", value.lower()))
+
+
+def trigrams(value: str) -> Set[str]:
+    padded = f"  {value} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ColumnVocabulary:
+    """Distinct values of one column with the n-gram/token features used for approximate matching."""
+
+    def __init__(self, values: List[Any]) -> None:
+        self.values = values
+        self.normalized = [normalize(str(v)) for v in values]
+        self.tokens = [set(n.split()) for n in self.normalized]
+        self.trigrams = [trigrams(n) for n in self.normalized]
+        self.initials = ["".join(t[0] for t in n.split()) for n in self.normalized]
+        self.postings: Dict[str, List[int]] = {}
+        for i, grams in enumerate(self.trigrams):
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(i)
+
+    def candidates(self, query_grams: Set[str]) -> List[int]:
+        if len(self.values) <= FULL_SCAN_LIMIT:
+            return list(range(len(self.values)))
+        overlap = Counter()
+        for gram in query_grams:
+            overlap.update(self.postings.get(gram, ()))
+        return [i for i, _ in overlap.most_common(MAX_CANDIDATES)]
+
+    def score(self, i: int, query: str, query_tokens: Set[str], query_grams: Set[str]) -> float:
+        value = self.normalized[i]
+        if not value:
+            return 0.0
+        if query == value:
+            return 1.0
+        if query == self.initials[i] and len(query) > 1:
+            return 0.9
+        grams = self.trigrams[i]
+        dice = 2 * len(query_grams & grams) / (len(query_grams) + len(grams))
+        union = query_tokens | self.tokens[i]
+        token_set = len(query_tokens & self.tokens[i]) / len(union) if union else 0.0
+        ratio = SequenceMatcher(None, query, value).ratio()
+        score = max(0.5 * dice + 0.5 * ratio, token_set)
+        # A whole-word or substring hit is strong evidence even when the stored value is much longer.
+        if query_tokens and query_tokens <= self.tokens[i]:
+            score = max(score, 0.85)
+        elif query in value:
+            score = max(score, 0.75)
+        return score
+
+    def search(self, value: str, k: int) -> List[Tuple[Any, float]]:
+        query = normalize(value)
+        expansions = [query] + ABBREVIATIONS.get(query, [])
+        best: Dict[int, float] = {}
+        for expansion in expansions:
+            # Expanded abbreviations are slightly discounted so a literal match still ranks first.
+            weight = 1.0 if expansion == query else 0.95
+            expansion_tokens = set(expansion.split())
+            expansion_grams = trigrams(expansion)
+            for i in self.candidates(expansion_grams):
+                s = weight * self.score(i, expansion, expansion_tokens, expansion_grams)
+                if s > best.get(i, 0.0):
+                    best[i] = s
+        ranked = sorted(
+            ((i, s) for i, s in best.items() if s >= MIN_SCORE),
+            key=lambda x: (-x[1], self.normalized[x[0]]),
+        )
+        return [(self.values[i], round(s, 3)) for i, s in ranked[:k]]
+
+
+class ValueFuzzySearch(BaseModel):
+    engine: Engine = Field(..., description="The engine to retrieve column vocabularies from.")
+    value_index: Optional[Any] = Field(None, description="Optional ValueIndex to read distinct values from.")
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _vocabulary(self, table: str, column: str) -> ColumnVocabulary:
+        db_path = self.engine.url.database
+        key = (db_path, db_fingerprint(db_path), table.lower(), column.lower())
+        with _vocabularies_lock:
+            vocabulary = _vocabularies.get(key)
+            if vocabulary is not None:
+                _vocabularies.move_to_end(key)
+                return vocabulary
+            build_lock = _build_locks.setdefault(key, threading.Lock())
+        try:
+            with build_lock:
+                with _vocabularies_lock:
+                    vocabulary = _vocabularies.get(key)
+                    if vocabulary is not None:
+                        _vocabularies.move_to_end(key)
+                        return vocabulary
+                vocabulary = ColumnVocabulary(self._read_values(table, column))
+                with _vocabularies_lock:
+                    _vocabularies[key] = vocabulary
+                    _vocabularies.move_to_end(key)
+                    while len(_vocabularies) > MAX_VOCABULARIES:
+                        _vocabularies.popitem(last=False)
+                    return vocabulary
+        finally:
+            # Threads already waiting hold their own reference; later calls find the vocabulary or retry a failed build.
+            with _vocabularies_lock:
+                if _build_locks.get(key) is build_lock:
+                    del _build_locks[key]
+
+    def _read_values(self, table: str, column: str) -> List[Any]:
+        if self.value_index is not None and self.value_index.has_column(table, column):
+            return self.value_index.values(table, column, limit=MAX_VOCABULARY_VALUES)
+        with self.engine.connect() as connection, \
+                sql_query_budget(connection.connection.dbapi_connection, timeout=VOCABULARY_QUERY_TIMEOUT):
+            res = connection.execute(text(
+                f"SELECT DISTINCT {column} FROM {table} WHERE {column} IS NOT NULL LIMIT {MAX_VOCABULARY_VALUES}"
+            ))
+            return [row[0] for row in res]
+
+    def invoke(self, table: str, column: str, value: str, k: int = 10) -> str:
+        try:
+            matches = self._vocabulary(table, column).search(value, k)
+            if not matches:
+                return f"No values in {table}.{column} resemble '{value}'."
+            return f"Values in {table}.{column} most similar to '{value}' (value, score): {matches}."
+        except Exception as e:
+            return f"Error retrieving similar values: {str(e)}"
+
+    @staticmethod
+    def get_info() -> Dict[str, Any]:
+        return {
+            "type": "function",
+            "function": {
+                "name": "value_fuzzy_search",
+                "description": "Retrieve the top k values from a column that best match the given value, ranked by similarity score. Handles abbreviations (e.g. 'Hb' for 'hemoglobin'), misspellings and word-order differences in one call.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "table": {"type": "string", "description": "The table name."},
+                        "column": {"type": "string", "description": "The column name."},
+                        "value": {"type": "string", "description": "The value, abbreviation or phrase to match."},
+                        "k": {"type": "integer", "description": "The maximum number of values to return. Default is 10."},
+                    },
+                    "required": ["table", "column", "value"],
+                },
+            },
+        }
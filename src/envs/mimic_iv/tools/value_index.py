@@ -0,0 +1,135 @@
+import os
+import re
+import sqlite3
+import threading
+from contextlib import closing
+from typing import Dict, List, Optional, Set, Tuple
+
+from src.utils import ReadOnlyConnections, atomic_write, db_fingerprint
+
+INDEX_SUFFIX = ".value_index.sqlite"
+TEXT_TYPES = ("CHAR", "CLOB", "TEXT")
+# Columns whose sampled values all look like dates/times are left to the plain LIKE scan: they make up
+# most of the distinct text in MIMIC-IV and are not what value lookups search for.
+TIMESTAMP_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?$")
+TIMESTAMP_SAMPLE_SIZE = 20
+# Columns with more distinct values than this are not indexed, so startup stays bounded.
+MAX_INDEXED_VALUES = 100000
+
+_shared_indexes: Dict[str, Optional["ValueIndex"]] = {}
+_shared_lock = threading.Lock()
+
+
+def list_text_columns(conn: sqlite3.Connection) -> List[Tuple[str, str]]:
+    """(table, column) pairs whose declared type has TEXT affinity."""
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite~_%' ESCAPE '~' ORDER BY name"
+    )]
+    columns = []
+    for table in tables:
+        for col in conn.execute(f"PRAGMA table_info('{table}')"):
+            # PRAGMA table_info returns: (cid, name, type, notnull, dflt_value, pk)
+            col_type = (col[2] or "").upper()
+            if any(t in col_type for t in TEXT_TYPES):
+                columns.append((table, col[1]))
+    return columns
+
+
+def is_timestamp_column(conn: sqlite3.Connection, table: str, column: str) -> bool:
+    """True if the column's name or its first few values look like dates/times."""
+    name = column.lower()
+    if name.endswith(("time", "date")):
+        return True
+    sample = [row[0] for row in conn.execute(
+        f'SELECT "{column}" FROM "{table}" WHERE "{column}" IS NOT NULL LIMIT {TIMESTAMP_SAMPLE_SIZE}'
+    )]
+    return bool(sample) and all(isinstance(v, str) and TIMESTAMP_PATTERN.match(v) for v in sample)
+
+
+class ValueIndex:
+    """FTS5 trigram side table over the distinct values of the text columns of a database.
+
+    The index lives next to the database (`<db_path>.value_index.sqlite`), is rebuilt only when
+    the database file changes, and answers `LIKE '%value%'` lookups without scanning the source tables.
+    """
+
+    def __init__(self, db_path: str, index_path: Optional[str] = None) -> None:
+        self.db_path = db_path
+        self.index_path = index_path or db_path + INDEX_SUFFIX
+        self.fingerprint = db_fingerprint(db_path)
+        if not self._is_fresh():
+            self._build()
+        self._connections = ReadOnlyConnections(self.index_path)
+        with closing(sqlite3.connect(self.index_path)) as conn:
+            self.columns: Set[Tuple[str, str]] = {
+                (tbl, col) for tbl, col in conn.execute("SELECT tbl, col FROM indexed_columns")
+            }
+
+    @classmethod
+    def shared(cls, db_path: str) -> Optional["ValueIndex"]:
+        """Return the process-wide index for `db_path`, or None if it cannot be built (e.g. no FTS5 trigram support)."""
+        key = os.path.abspath(db_path)
+        with _shared_lock:
+            if key not in _shared_indexes or (
+                _shared_indexes[key] is not None and _shared_indexes[key].fingerprint != db_fingerprint(db_path)
+            ):
+                try:
+                    _shared_indexes[key] = cls(db_path)
+                except (sqlite3.Error, OSError):
+                    _shared_indexes[key] = None
+            return _shared_indexes[key]
+
+    def _is_fresh(self) -> bool:
+        if not os.path.exists(self.index_path):
+            return False
+        try:
+            with closing(sqlite3.connect(self.index_path)) as conn:
+                row = conn.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        except sqlite3.Error:
+            return False
+        return row is not None and row[0] == self.fingerprint
+
+    def _build(self) -> None:
+        def write(tmp_path: str) -> None:
+            src = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            dst = sqlite3.connect(tmp_path)
+            try:
+                dst.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+                dst.execute("CREATE TABLE indexed_columns (tbl TEXT, col TEXT, PRIMARY KEY (tbl, col))")
+                dst.execute("CREATE VIRTUAL TABLE value_fts USING fts5(value, tbl UNINDEXED, col UNINDEXED, tokenize='trigram')")
+                for table, column in list_text_columns(src):
+                    if is_timestamp_column(src, table, column):
+                        continue
+                    values = [row[0] for row in src.execute(
+                        f'SELECT DISTINCT "{column}" FROM "{table}" WHERE "{column}" IS NOT NULL LIMIT {MAX_INDEXED_VALUES + 1}'
+                    )]
+                    # Columns holding non-text or too many values keep using the plain LIKE scan so results stay identical.
+                    if len(values) > MAX_INDEXED_VALUES or not all(isinstance(v, str) for v in values):
+                        continue
+                    tbl, col = table.lower(), column.lower()
+                    dst.executemany("INSERT INTO value_fts (value, tbl, col) VALUES (?, ?, ?)", [(v, tbl, col) for v in values])
+                    dst.execute("INSERT INTO indexed_columns VALUES (?, ?)", (tbl, col))
+                dst.execute("INSERT INTO meta VALUES ('fingerprint', ?)", (self.fingerprint,))
+                dst.commit()
+            finally:
+                src.close()
+                dst.close()
+        atomic_write(self.index_path, write)
+
+    def has_column(self, table: str, column: str) -> bool:
+        return (table.lower(), column.lower()) in self.columns
+
+    def search(self, table: str, column: str, value: str, k: int = 100) -> List[str]:
+        """Up to k distinct values of table.column containing `value` (case-insensitive, LIKE semantics)."""
+        rows = self._connections.get().execute(
+            "SELECT value FROM value_fts WHERE value LIKE ? AND tbl = ? AND col = ? LIMIT ?",
+            (f"%{value}%", table.lower(), column.lower(), k),
+        )
+        return [row[0] for row in rows]
+
+    def values(self, table: str, column: str, limit: int = -1) -> List[str]:
+        """Distinct values of an indexed table.column (all of them unless `limit` is given)."""
+        rows = self._connections.get().execute(
+            "SELECT value FROM value_fts WHERE tbl = ? AND col = ? LIMIT ?", (table.lower(), column.lower(), limit)
+        )
+        return [row[0] for row in rows]
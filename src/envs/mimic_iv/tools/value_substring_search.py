@@ -1,46 +1,67 @@
 import json
 import ast
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from sqlalchemy import text
 from sqlalchemy.engine import Engine
 from pydantic import BaseModel, Field
 
+from src.envs.query_cache import get_query_cache
+
 class ValueSubstringSearch(BaseModel):
     engine: Engine = Field(..., description="The engine to retrieve sample values from.")
+    value_index: Optional[Any] = Field(None, description="Optional ValueIndex answering lookups without scanning the table.")
 
     class Config:
         arbitrary_types_allowed = True
 
     def invoke(self, table: str, column: str, value: str, k: int = 100) -> str:
+        use_index = self.value_index is not None and self.value_index.has_column(table, column)
+        cache = get_query_cache()
+        # The index and the table scan may order or select values differently, so each has its own entries.
+        key = cache.make_key(
+            self.engine.url.database, "substring_search", f"{table}.{column}", value, k, "index" if use_index else "scan"
+        )
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
         try:
-            pattern = f"%{value}%"
-            with self.engine.connect() as connection:
-                # Step 1: Count total matching distinct values
-                count_query = text(
-                    f"SELECT COUNT(DISTINCT {column}) FROM {table} WHERE {column} LIKE :pattern COLLATE NOCASE"
-                )
-                count_result = connection.execute(count_query, {"pattern": pattern})
-                n = count_result.scalar()
-                if n is None:
+            if use_index:
+                matching_vals = self.value_index.search(table, column, value, k)
+            else:
+                matching_vals = self._scan(table, column, value, k)
+                if matching_vals is None:
                     return f"Error: Unable to count matches in {table}.{column} for '{value}'."
-                
-                # Step 2: Retrieve up to k matching distinct values
-                query = text(
-                    f"SELECT DISTINCT {column} FROM {table} WHERE {column} LIKE :pattern COLLATE NOCASE LIMIT {k}"
-                )
-                res = connection.execute(query, {"pattern": pattern})
-                matching_vals = [row[0] for row in res if row[0] is not None]
-                matching_vals = list(set(matching_vals))  # Ensure uniqueness
 
-                if not matching_vals:
-                    return f"No values in {table}.{column} contain '{value}'."
-                
-                # Step 3: Construct the response
-                base_response = f"Values in {table}.{column} containing '{value}': {matching_vals}."
-                return base_response
+            if not matching_vals:
+                return f"No values in {table}.{column} contain '{value}'."
+            
+            # Construct the response
+            base_response = f"Values in {table}.{column} containing '{value}': {matching_vals}."
+            cache.put(key, base_response)
+            return base_response
         except Exception as e:
             return f"Error retrieving matching values: {str(e)}"
 
+    def _scan(self, table: str, column: str, value: str, k: int) -> Optional[list]:
+        pattern = f"%{value}%"
+        with self.engine.connect() as connection:
+            # Step 1: Count total matching distinct values
+            count_query = text(
+                f"SELECT COUNT(DISTINCT {column}) FROM {table} WHERE {column} LIKE :pattern COLLATE NOCASE"
+            )
+            count_result = connection.execute(count_query, {"pattern": pattern})
+            n = count_result.scalar()
+            if n is None:
+                return None
+            
+            # Step 2: Retrieve up to k matching distinct values
+            query = text(
+                f"SELECT DISTINCT {column} FROM {table} WHERE {column} LIKE :pattern COLLATE NOCASE LIMIT {k}"
+            )
+            res = connection.execute(query, {"pattern": pattern})
+            matching_vals = [row[0] for row in res if row[0] is not None]
+            return list(set(matching_vals))  # Ensure uniqueness
+
     @staticmethod
     def get_info() -> Dict[str, Any]:
         return {
@@ -0,0 +1,90 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from src.utils import db_fingerprint
+
+DEFAULT_MAX_ENTRIES = 4096
+
+
+def normalize_sql(query: str) -> str:
+    """Cache-key text of a query: only surrounding whitespace and trailing `;` are dropped.
+
+    Inner whitespace is kept as is: a newline can end a `--` comment, so collapsing it could
+    make two different queries share a key.
+    """
+    return query.strip().rstrip(";").strip()
+
+
+class QueryCache:
+    """Thread-safe, size-bounded LRU cache of query results shared by tools and reward computation.
+
+    Keys are scoped to the database file's identity (path, size and mtime), so a modified database
+    never serves stale results.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+
+    @staticmethod
+    def make_key(db_path: str, namespace: str, query: str, *params: Hashable) -> Tuple:
+        return (os.path.abspath(db_path), db_fingerprint(db_path), namespace, normalize_sql(query), params)
+
+    def get(self, key: Tuple) -> Optional[Any]:
+        namespace = key[2]
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits[namespace] = self.hits.get(namespace, 0) + 1
+                return self._entries[key]
+            self.misses[namespace] = self.misses.get(namespace, 0) + 1
+            return None
+
+    def put(self, key: Tuple, value: Any) -> None:
+        if self.max_entries <= 0 or value is None:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits.clear()
+            self.misses.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            namespaces = sorted(set(self.hits) | set(self.misses))
+            hits, misses = sum(self.hits.values()), sum(self.misses.values())
+            return {
+                "entries": len(self._entries),
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+                "by_namespace": {ns: {"hits": self.hits.get(ns, 0), "misses": self.misses.get(ns, 0)} for ns in namespaces},
+            }
+
+
+_query_cache = QueryCache()
+
+
+def get_query_cache() -> QueryCache:
+    """The process-wide query cache."""
+    return _query_cache
+
+
+def configure_query_cache(max_entries: int) -> QueryCache:
+    """Resize the process-wide cache (0 disables caching)."""
+    with _query_cache._lock:
+        _query_cache.max_entries = max_entries
+        while len(_query_cache._entries) > max(max_entries, 0):
+            _query_cache._entries.popitem(last=False)
+    return _query_cache
@@ -1,9 +1,10 @@
 import abc
-import time
-from litellm import completion
+import asyncio
 from litellm.exceptions import ContextWindowExceededError
 from typing import Optional, List, Dict, Any
 
+from src import llm
+
 class BaseUser(abc.ABC):
     @abc.abstractmethod
     def reset(self, instruction: Optional[str] = None) -> str:
@@ -17,13 +18,19 @@ class BaseUser(abc.ABC):
     def get_total_cost(self) -> float:
         raise NotImplementedError
 
+    async def areset(self, instruction: Optional[str] = None) -> str:
+        # Users without a native async implementation run the blocking call on a worker thread.
+        return await asyncio.to_thread(self.reset, instruction)
+
+    async def astep(self, content: str) -> str:
+        return await asyncio.to_thread(self.step, content)
+
 class LLMUser(BaseUser):
     def __init__(self, model: str) -> None:
         super().__init__()
         self.messages: List[Dict[str, Any]] = []
         self.model = model
         self.total_cost = 0.0
-        self.reset()
 
     #def generate_next_message(self, messages: List[Dict[str, Any]]) -> str:
     #    res = completion(
@@ -35,25 +42,33 @@ class LLMUser(BaseUser):
     #    return message.content
     
     ####
+    def accept_message(self, res: Any, messages: List[Dict[str, Any]]) -> str:
+        message = res.choices[0].message
+        if len(self.messages) > 2 and message.content and ('SELECT' in message.content or 'default_api' in message.content or 'print(' in message.content):
+            messages += [{"role": "user", "content": "You must act like a user, not like a DB agent. Do not generate any SQL query or other DB agent artifacts like default_api or print() in your response, but follow the instruction and rules in the system prompt."}]
+            raise ValueError("The user acts like a DB agent: the user response includes SQL query or other DB agent artifacts like default_api or print()")
+        self.messages.append(message.model_dump())
+        self.total_cost += res._hidden_params["response_cost"]
+        return message.content
+
     def generate_next_message(self, messages: List[Dict[str, Any]]) -> str:
-        while True:
-            try:
-                res = completion(
-                    model=self.model, messages=messages, temperature=0.5
-                )
-                message = res.choices[0].message
-                if len(self.messages) > 2 and message.content and ('SELECT' in message.content or 'default_api' in message.content or 'print(' in message.content):
-                    messages += [{"role": "user", "content": "You must act like a user, not like a DB agent. Do not generate any SQL query or other DB agent artifacts like default_api or print() in your response, but follow the instruction and rules in the system prompt."}]
-                    raise ValueError("The user acts like a DB agent: the user response includes SQL query or other DB agent artifacts like default_api or print()")
-                self.messages.append(message.model_dump())
-                self.total_cost += res._hidden_params["response_cost"]
-                return message.content
-            except ContextWindowExceededError as e:
-                #print("⚠️ Context window exceeded:", e)
-                return '###END###'
-            except Exception as e:
-                #print(f"[User] Error: {e}")
-                time.sleep(3)        
+        try:
+            return llm.complete(
+                accept=lambda res: self.accept_message(res, messages),
+                model=self.model, messages=messages, temperature=0.5
+            )
+        except ContextWindowExceededError as e:
+            #print("⚠️ Context window exceeded:", e)
+            return '###END###'
+
+    async def agenerate_next_message(self, messages: List[Dict[str, Any]]) -> str:
+        try:
+            return await llm.acomplete(
+                accept=lambda res: self.accept_message(res, messages),
+                model=self.model, messages=messages, temperature=0.5
+            )
+        except ContextWindowExceededError:
+            return '###END###'
                 
     ####
 
@@ -94,14 +109,17 @@ User instruction: {instruction_display}
 23. Whenever asked about the information about the database or SQL, you should say "You should find that out for me."
 """
 
-    def reset(self, instruction: Optional[str] = None) -> str:
-        self.messages = [
+    def start_messages(self, instruction: Optional[str]) -> List[Dict[str, Any]]:
+        return [
             {
                 "role": "system",
                 "content": self.build_system_prompt(instruction=instruction),
             },
             {"role": "user", "content": "Hi! How can I help you today?"},
         ]
+
+    def reset(self, instruction: Optional[str] = None) -> str:
+        self.messages = self.start_messages(instruction)
         new_message = self.generate_next_message(self.messages)
         return new_message
 
@@ -110,6 +128,14 @@ User instruction: {instruction_display}
         new_message = self.generate_next_message(self.messages)
         return new_message
 
+    async def areset(self, instruction: Optional[str] = None) -> str:
+        self.messages = self.start_messages(instruction)
+        return await self.agenerate_next_message(self.messages)
+
+    async def astep(self, content: str) -> str:
+        self.messages.append({"role": "user", "content": content})
+        return await self.agenerate_next_message(self.messages)
+
     def get_total_cost(self) -> float:
         return round(self.total_cost, 8)
 
@@ -0,0 +1,355 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import hashlib
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from litellm import ModelResponse, completion, acompletion
+from litellm.exceptions import AuthenticationError, ContextWindowExceededError, RateLimitError
+
+from src import telemetry
+from src.utils import estimate_tokens
+
+DEFAULT_MAX_RETRIES = 8
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+# Retrying these cannot succeed, so they are raised to the caller immediately.
+NON_RETRYABLE = (ContextWindowExceededError, AuthenticationError)
+DEFAULT_CACHE_MAX_MB = 1024
+# Eviction trims the cache to this fraction of its limit so it does not evict on every write.
+EVICT_TO = 0.9
+
+
+class TokenBucket:
+    """Refills `per_minute` units per minute; callers reserve units up front and sleep off any deficit."""
+
+    def __init__(self, per_minute: float) -> None:
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Debit `amount` and return how long the caller must wait before using it."""
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+        return max(0.0, -self.tokens / self.rate)
+
+    def adjust(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.tokens -= amount
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter: uniform in [0, min(MAX_DELAY, BASE_DELAY * 2**attempt)]."""
+    return random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+
+
+class ModelLimiter:
+    """Request and token budgets of one model, plus a cooldown shared by every caller after a 429."""
+
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None) -> None:
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.cooldown_until = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "retries": 0, "rate_limited": 0, "failures": 0, "wait_seconds": 0.0}
+
+    def reserve(self, tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            wait = self.cooldown_until - now
+            if self.requests is not None:
+                wait = max(wait, self.requests.reserve(1, now))
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.reserve(tokens, now))
+            wait = max(wait, 0.0)
+            self.stats["calls"] += 1
+            self.stats["wait_seconds"] += wait
+            return wait
+
+    def settle(self, res: Any, estimated: int) -> None:
+        """Charge the difference between the estimated and the reported token usage."""
+        usage = getattr(res, "usage", None)
+        total = getattr(usage, "total_tokens", None)
+        if self.tokens is None or not total:
+            return
+        with self._lock:
+            self.tokens.adjust(total - estimated, time.monotonic())
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.stats["failures"] += 1
+
+    def backoff(self, attempt: int, error: Exception) -> float:
+        """Exponential backoff with full jitter; a 429 also pauses every other caller of this model."""
+        delay = backoff_delay(attempt)
+        with self._lock:
+            self.stats["retries"] += 1
+            if isinstance(error, RateLimitError):
+                self.stats["rate_limited"] += 1
+                self.cooldown_until = max(self.cooldown_until, time.monotonic() + delay)
+        return delay
+
+
+_limits: Dict[str, Tuple[Optional[float], Optional[float]]] = {}
+_default_limits: Tuple[Optional[float], Optional[float]] = (None, None)
+_max_retries = DEFAULT_MAX_RETRIES
+_limiters: Dict[str, ModelLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def configure_rate_limits(
+    rpm: Optional[float] = None,
+    tpm: Optional[float] = None,
+    per_model: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]] = None,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+) -> None:
+    """Set the default requests/tokens per minute, per-model overrides and the retry budget of each call."""
+    global _default_limits, _max_retries
+    with _limiters_lock:
+        _default_limits = (rpm, tpm)
+        _limits.clear()
+        _limits.update(per_model or {})
+        _max_retries = max_retries
+        _limiters.clear()
+
+
+def parse_rate_limit(spec: str) -> Tuple[str, Tuple[Optional[float], Optional[float]]]:
+    """Parse `MODEL=RPM[,TPM]` (model names may contain '/' and ':')."""
+    model, _, limits = spec.rpartition("=")
+    if not model:
+        raise ValueError(f"Invalid rate limit '{spec}', expected MODEL=RPM[,TPM]")
+    rpm, _, tpm = limits.partition(",")
+    return model, (float(rpm) if rpm else None, float(tpm) if tpm else None)
+
+
+def get_limiter(model: str) -> ModelLimiter:
+    with _limiters_lock:
+        limiter = _limiters.get(model)
+        if limiter is None:
+            limiter = _limiters[model] = ModelLimiter(*_limits.get(model, _default_limits))
+        return limiter
+
+
+def rate_limit_stats() -> Dict[str, Dict[str, Any]]:
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {model: {**l.stats, "wait_seconds": round(l.stats["wait_seconds"], 2)} for model, l in limiters.items()}
+
+
+class ResponseCache:
+    """On-disk cache of completions keyed by the full request, for replaying runs without new LLM calls.
+
+    Responses are stored in SQLite (WAL mode, so concurrent runs can share one file); the least recently
+    used entries are evicted once the stored responses exceed `max_bytes`. Cached responses report a cost of 0.
+    """
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_CACHE_MAX_MB * 2 ** 20) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, last_access REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._conn.commit()
+        self.size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.hits = self.misses = self.writes = self.evictions = 0
+
+    @staticmethod
+    def make_key(kwargs: Dict[str, Any], scope: Tuple[str, ...]) -> str:
+        request = json.dumps({"request": kwargs, "scope": scope}, sort_keys=True, default=str)
+        return hashlib.sha256(request.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[ModelResponse]:
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        res = ModelResponse(**json.loads(row[0]))
+        res._hidden_params["response_cost"] = 0.0
+        return res
+
+    def put(self, key: str, model: str, res: Any) -> None:
+        data = res.model_dump_json()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (key, model, data, len(data), time.time())
+            )
+            self.size += len(data) - (old[0] if old else 0)
+            self.writes += 1
+            if self.size > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        target = self.max_bytes * EVICT_TO
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY last_access")
+        victims = []
+        for key, size in rows:
+            if self.size <= target:
+                break
+            victims.append((key,))
+            self.size -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+        self.evictions += len(victims)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "size_mb": round(self.size / 2 ** 20, 2),
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_response_cache: Optional[ResponseCache] = None
+# Distinguishes otherwise identical requests that must not share a response (trials, retries, user samples).
+_cache_scope: contextvars.ContextVar = contextvars.ContextVar("llm_cache_scope", default=())
+
+
+def configure_response_cache(path: Optional[str], max_mb: float = DEFAULT_CACHE_MAX_MB) -> Optional[ResponseCache]:
+    """Enable the on-disk response cache at `path` (None disables it)."""
+    global _response_cache
+    if _response_cache is not None:
+        _response_cache.close()
+    _response_cache = ResponseCache(path, int(max_mb * 2 ** 20)) if path else None
+    return _response_cache
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    return _response_cache
+
+
+@contextmanager
+def cache_scope(*parts: str):
+    """Add `parts` to the cache key of every LLM call made in this context (threads need `copy_context`)."""
+    token = _cache_scope.set(_cache_scope.get() + parts)
+    try:
+        yield
+    finally:
+        _cache_scope.reset(token)
+
+
+def _lookup(kwargs: Dict[str, Any], rejected: Set[str]) -> Tuple[Optional[str], Any]:
+    """Cache key of the request as it is about to be sent, and its cached response unless the caller just rejected it."""
+    if _response_cache is None:
+        return None, None
+    key = ResponseCache.make_key(kwargs, _cache_scope.get())
+    return key, None if key in rejected else _response_cache.get(key)
+
+
+def _request_tokens(kwargs: Dict[str, Any]) -> int:
+    tokens = estimate_tokens(kwargs.get("messages", []))
+    if kwargs.get("tools"):
+        tokens += len(json.dumps(kwargs["tools"])) // 4
+    return tokens
+
+
+def _give_up(limiter: ModelLimiter, attempt: int) -> None:
+    """Re-raise the exception being handled once the retry budget is spent."""
+    if attempt == _max_retries:
+        limiter.record_failure()
+        telemetry.annotate(llm_calls=1, retries=attempt)
+        raise
+
+
+def complete(accept: Optional[Callable[[Any], Any]] = None, **kwargs: Any) -> Any:
+    """`litellm.completion` under the model's rate limit, retried with backoff up to the retry budget.
+
+    `accept` turns the response into the return value; raising from it rejects the response and asks again
+    at once (it may first correct the prompt in place). With the response cache enabled, every response is
+    stored under the prompt it answered, rejected ones included, so a replay takes the same path.
+    """
+    limiter = get_limiter(kwargs["model"])
+    rejected: Set[str] = set()
+    for attempt in range(_max_retries + 1):
+        key, res = _lookup(kwargs, rejected)
+        cached = res is not None
+        if not cached:
+            estimated = _request_tokens(kwargs)
+            time.sleep(limiter.reserve(estimated))
+            try:
+                res = completion(**kwargs)
+            except NON_RETRYABLE:
+                raise
+            except Exception as e:
+                _give_up(limiter, attempt)
+                time.sleep(limiter.backoff(attempt, e))
+                continue
+            limiter.settle(res, estimated)
+            if key is not None:
+                _response_cache.put(key, kwargs["model"], res)
+        try:
+            value = accept(res) if accept is not None else res
+        except NON_RETRYABLE:
+            raise
+        except Exception:
+            _give_up(limiter, attempt)
+            if key is not None:
+                rejected.add(key)
+            continue
+        telemetry.record_llm_call(None if cached else res, retries=attempt, cached=cached)
+        return value
+
+
+async def acomplete(accept: Optional[Callable[[Any], Any]] = None, **kwargs: Any) -> Any:
+    """Async counterpart of `complete`, built on `litellm.acompletion`."""
+    limiter = get_limiter(kwargs["model"])
+    rejected: Set[str] = set()
+    for attempt in range(_max_retries + 1):
+        key, res = _lookup(kwargs, rejected)
+        cached = res is not None
+        if not cached:
+            estimated = _request_tokens(kwargs)
+            await asyncio.sleep(limiter.reserve(estimated))
+            try:
+                res = await acompletion(**kwargs)
+            except NON_RETRYABLE:
+                raise
+            except Exception as e:
+                _give_up(limiter, attempt)
+                await asyncio.sleep(limiter.backoff(attempt, e))
+                continue
+            limiter.settle(res, estimated)
+            if key is not None:
+                _response_cache.put(key, kwargs["model"], res)
+        try:
+            value = accept(res) if accept is not None else res
+        except NON_RETRYABLE:
+            raise
+        except Exception:
+            _give_up(limiter, attempt)
+            if key is not None:
+                rejected.add(key)
+            continue
+        telemetry.record_llm_call(None if cached else res, retries=attempt, cached=cached)
+        return value
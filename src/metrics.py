@@ -0,0 +1,35 @@
+from math import comb
+from typing import List
+
+from src.types import EnvRunResult
+
+
+def display_metrics(results: List[EnvRunResult]) -> None:
+    """Compute and display average reward and pass@k/pass^k metrics."""
+    def is_successful(reward: float) -> bool:
+        return (1 - 1e-6) <= reward <= (1 + 1e-6)
+
+    unique_trials = len(set(r.trial for r in results))
+    rewards = [r.reward for r in results]
+    avg_reward = round(sum(rewards) / len(rewards) * 100, 1)
+    
+    success_counts: dict[int, int] = {}
+    for res in results:
+        success_counts[res.task_idx] = success_counts.get(res.task_idx, 0) + (1 if is_successful(res.reward) else 0)
+
+    pass_at_k = {}
+    for k in range(1, unique_trials + 1):
+        pass_k_total = sum(comb(unique_trials - success, k) / comb(unique_trials, k) for success in success_counts.values())
+        pass_at_k[k] = round((1 - (pass_k_total / len(success_counts))) * 100, 3)
+
+    pass_hat_k = {}
+    for k in range(1, unique_trials + 1):
+        pass_k_total = sum(comb(success, k) / comb(unique_trials, k) for success in success_counts.values())
+        pass_hat_k[k] = round((pass_k_total / len(success_counts)) * 100, 3)
+
+
+    # Runs with fewer than 4 trials per task (e.g. debug runs) report the largest k they support.
+    k = min(4, unique_trials)
+    print(f"📈 Pass@{k}: {pass_at_k[k]} (%)")
+    print(f"📈 Pass^{k}: {pass_hat_k[k]} (%)")
+    print(f"🏆 Final Score: {(pass_at_k[k]+pass_hat_k[k])/2} (%)")
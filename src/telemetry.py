@@ -0,0 +1,127 @@
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# Counters that LLM calls add to the innermost open span.
+LLM_COUNTERS = ("llm_calls", "cached_calls", "prompt_tokens", "completion_tokens", "retries")
+
+
+class SpanRecorder:
+    """Collects the timing spans of one episode; spans may be closed from several threads."""
+
+    def __init__(self) -> None:
+        self.spans: List[Dict[str, Any]] = []
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, span: Dict[str, Any]) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def annotate(self, span: Dict[str, Any], counts: Dict[str, int]) -> None:
+        with self._lock:
+            for name, value in counts.items():
+                span[name] = span.get(name, 0) + value
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(span) for span in self.spans]
+
+
+_recorder: contextvars.ContextVar = contextvars.ContextVar("telemetry_recorder", default=None)
+_current_span: contextvars.ContextVar = contextvars.ContextVar("telemetry_span", default=None)
+
+
+@contextmanager
+def recording() -> Iterator[SpanRecorder]:
+    """Record the spans opened in this context (threads need `copy_context`, like `llm.cache_scope`)."""
+    recorder = SpanRecorder()
+    token = _recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _recorder.reset(token)
+
+
+@contextmanager
+def span(stage: str, name: Optional[str] = None) -> Iterator[Optional[Dict[str, Any]]]:
+    """Time the enclosed block as one `stage` span; a no-op outside `recording`."""
+    recorder = _recorder.get()
+    if recorder is None:
+        yield None
+        return
+    start = time.perf_counter()
+    record: Dict[str, Any] = {"stage": stage, "start": round(start - recorder.started, 6)}
+    if name is not None:
+        record["name"] = name
+    token = _current_span.set(record)
+    try:
+        yield record
+    finally:
+        _current_span.reset(token)
+        record["duration"] = round(time.perf_counter() - start, 6)
+        recorder.add(record)
+
+
+def annotate(**counts: int) -> None:
+    """Add `counts` (tokens, retries, ...) to the innermost open span, if any."""
+    recorder, record = _recorder.get(), _current_span.get()
+    if recorder is not None and record is not None:
+        recorder.annotate(record, counts)
+
+
+def record_llm_call(res: Any = None, retries: int = 0, cached: bool = False) -> None:
+    usage = getattr(res, "usage", None)
+    annotate(
+        llm_calls=1,
+        cached_calls=int(cached),
+        prompt_tokens=getattr(usage, "prompt_tokens", None) or 0,
+        completion_tokens=getattr(usage, "completion_tokens", None) or 0,
+        retries=retries,
+    )
+
+
+def span_label(span: Dict[str, Any]) -> str:
+    return f"{span['stage']}:{span['name']}" if span.get("name") else span["stage"]
+
+
+def summarize_spans(spans: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Count, p50/p95/total seconds and LLM counters of the spans, per stage (tools per tool name)."""
+    grouped: Dict[str, List[Dict[str, Any]]] = {}
+    for span in spans:
+        grouped.setdefault(span_label(span), []).append(span)
+    summary = {}
+    for label in sorted(grouped):
+        group = grouped[label]
+        durations = np.array([span["duration"] for span in group])
+        p50, p95 = np.percentile(durations, [50, 95])
+        summary[label] = {
+            "count": len(group),
+            "p50": round(float(p50), 4),
+            "p95": round(float(p95), 4),
+            "total": round(float(durations.sum()), 2),
+            **{counter: sum(span.get(counter, 0) for span in group) for counter in LLM_COUNTERS},
+        }
+    return summary
+
+
+def format_table(rows: List[Tuple[Any, ...]]) -> str:
+    """Rows as aligned plain-text columns: the first left-aligned, the others right-aligned."""
+    widths = [max(len(str(row[i])) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join(
+        "  ".join(str(cell).ljust(w) if i == 0 else str(cell).rjust(w) for i, (cell, w) in enumerate(zip(row, widths)))
+        for row in rows
+    )
+
+
+def format_summary(spans: List[Dict[str, Any]]) -> str:
+    """Plain-text table of `summarize_spans`, one row per stage."""
+    header = ("stage", "count", "p50 s", "p95 s", "total s", "llm calls", "cached", "prompt tok", "compl tok", "retries")
+    return format_table([header] + [
+        (label, s["count"], s["p50"], s["p95"], s["total"], s["llm_calls"], s["cached_calls"], s["prompt_tokens"], s["completion_tokens"], s["retries"])
+        for label, s in summarize_spans(spans).items()
+    ])
@@ -49,4 +49,6 @@ class EnvRunResult(BaseModel):
     reward: Optional[float] = None
     info: Dict[str, Any]
     messages: List[Dict[str, Any]]
-    cost: CostInfo
\ No newline at end of file
+    cost: CostInfo
+    # Timing spans of the episode (see src/telemetry.py), including discarded re-simulations.
+    spans: List[Dict[str, Any]] = []
\ No newline at end of file
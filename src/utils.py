@@ -1,7 +1,16 @@
+import os
 import json
 import re
+import time
+import math
+import heapq
+import sqlite3
+import threading
 from ast import literal_eval
-from typing import Dict, Any
+from contextlib import contextmanager
+from typing import Callable, Dict, Any, List, Optional
+
+import numpy as np
 from src.types import Action
 
 def parse_sql(response: str) -> str:
@@ -21,15 +30,134 @@ def process_item(item):
         pass
     return str(item)
 
+# Only the first 100 rows (in sorted order) of a result are compared.
+MAX_COMPARED_ROWS = 100
+# Stands in for -0.0, which compares equal to 0 (so would share its memoized string) but prints differently.
+_NEGATIVE_ZERO = object()
+
+def _process_rows(rows):
+    return sorted([[process_item(c) for c in row] for row in rows])[:MAX_COMPARED_ROWS]
+
+def _column_strings(column):
+    """`process_item` of every cell of a column, converting each distinct value once."""
+    uniques = set(column)
+    if 0 in uniques:
+        column = [_NEGATIVE_ZERO if type(v) is float and v == 0 and math.copysign(1.0, v) < 0 else v for v in column]
+        uniques = set(column)
+    as_string = dict(zip(uniques, map(process_item, uniques)))
+    if _NEGATIVE_ZERO in as_string:
+        as_string[_NEGATIVE_ZERO] = "-0.0"
+    return list(map(as_string.__getitem__, column))
+
+def _process_rows_columnar(rows):
+    """Same output as `_process_rows`, without converting every cell or sorting every row.
+
+    Only the leading column is converted for all rows; the rows whose leading string is no greater than
+    the 100th smallest one are the only ones that can reach the first 100, so the other columns are
+    converted and ranked for those candidates alone, and the candidates are ordered with a lexsort.
+    """
+    width = len(rows[0])
+    if width == 0 or any(len(row) != width for row in rows):
+        return _process_rows(rows)
+    leading = _column_strings([row[0] for row in rows])
+    if len(rows) > MAX_COMPARED_ROWS:
+        threshold = heapq.nsmallest(MAX_COMPARED_ROWS, leading)[-1]
+        candidates = [i for i, string in enumerate(leading) if string <= threshold]
+        rows = [rows[i] for i in candidates]
+        leading = [leading[i] for i in candidates]
+    columns = [leading] + [_column_strings(column) for column in list(zip(*rows))[1:]]
+    codes = []
+    for strings in columns:
+        rank = {string: i for i, string in enumerate(sorted(set(strings)))}
+        codes.append(np.fromiter(map(rank.__getitem__, strings), dtype=np.int64, count=len(strings)))
+    # np.lexsort sorts by its last key first.
+    order = np.lexsort(codes[::-1])[:MAX_COMPARED_ROWS]
+    return [[column[i] for column in columns] for i in order]
+
 def process_result(result):
-    try:
-        result = literal_eval(result)
-    except:
-        pass
+    # Only text needs parsing; literal_eval on a list of rows would fail anyway, after formatting all of it into the error.
+    if isinstance(result, str):
+        try:
+            result = literal_eval(result)
+        except:
+            pass
     if type(result)==str:
         return result
     else:
-        return sorted([[process_item(c) for c in row] for row in result])[:100] # only compare first 100 results
+        rows = result if isinstance(result, list) else list(result)
+        if not rows:
+            return []
+        try:
+            return _process_rows_columnar(rows)
+        except TypeError:
+            # Unhashable or unsized cells/rows keep the row-wise path.
+            return _process_rows(rows)
+
+def atomic_write(path: str, write: Callable[[str], None]) -> None:
+    """Have `write` create the file at a temporary path, then swap it in, so concurrent readers never see a partial file."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+class ReadOnlyConnections:
+    """One read-only connection to a SQLite file per thread (sqlite3 connections are bound to the thread that created them)."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+
+    def get(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+            self._local.conn = conn
+        return conn
+
+def db_fingerprint(db_path: str) -> str:
+    """Cheap identity of a database file (size and mtime) used to key derived artifacts."""
+    stat = os.stat(db_path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+# Number of SQLite VM instructions between two progress-handler callbacks.
+PROGRESS_HANDLER_INTERVAL = 1000
+DEFAULT_QUERY_TIMEOUT = 30.0
+
+class QueryTimeoutError(Exception):
+    pass
+
+@contextmanager
+def sql_query_budget(conn: sqlite3.Connection, timeout: Optional[float] = DEFAULT_QUERY_TIMEOUT, max_steps: Optional[int] = None):
+    """Cancel statements run on `conn` inside this block once they exceed `timeout` seconds or `max_steps` VM steps.
+
+    A cancelled statement raises QueryTimeoutError instead of SQLite's generic "interrupted" error.
+    """
+    if timeout is None and max_steps is None:
+        yield
+        return
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    state = {"steps": 0, "exceeded": None}
+
+    def progress_handler() -> int:
+        state["steps"] += PROGRESS_HANDLER_INTERVAL
+        if deadline is not None and time.monotonic() > deadline:
+            state["exceeded"] = f"time limit of {timeout} seconds"
+        elif max_steps is not None and state["steps"] > max_steps:
+            state["exceeded"] = f"limit of {max_steps} execution steps"
+        # A non-zero return value makes SQLite abort the running statement.
+        return 1 if state["exceeded"] else 0
+
+    conn.set_progress_handler(progress_handler, PROGRESS_HANDLER_INTERVAL)
+    try:
+        yield
+    except Exception as e:
+        if state["exceeded"]:
+            raise QueryTimeoutError(f"Query cancelled because it exceeded the {state['exceeded']}. Simplify the query (e.g. add filters or avoid cross joins) and try again.") from e
+        raise
+    finally:
+        conn.set_progress_handler(None, PROGRESS_HANDLER_INTERVAL)
 
 def convert_message_to_action(
     message: Dict[str, Any],
@@ -42,3 +170,16 @@ def convert_message_to_action(
         )
     else:
         return Action(name='respond', kwargs={"content": message["content"]})
+
+def extract_actions(messages: List[Dict[str, Any]]) -> List[Action]:
+    """Actions of a saved trajectory in order: one per assistant message, as the agent issued them."""
+    return [convert_message_to_action(message) for message in messages if message.get("role") == "assistant"]
+
+def estimate_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Rough prompt size (~4 characters per token) used for budgeting before the provider reports usage."""
+    chars = 0
+    for message in messages:
+        chars += len(str(message.get("content") or ""))
+        if message.get("tool_calls"):
+            chars += len(json.dumps(message["tool_calls"]))
+    return chars // 4 + 4 * len(messages)
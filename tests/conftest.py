@@ -0,0 +1,87 @@
+import os
+import sys
+
+# Keep litellm from fetching its model cost map over the network when src.llm is imported.
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+
+import pytest
+
+from src.envs.mimic_iv.tools.sql_db_query import MAX_CACHED_ROWS
+from src.types import RewardInfo, Task
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """A small MIMIC-IV-like SQLite database in a temporary directory."""
+    path = str(tmp_path / "test.sqlite")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE patients (subject_id INT PRIMARY KEY, gender TEXT)")
+        conn.executemany("INSERT INTO patients VALUES (?, ?)", [(1, "F"), (2, "M"), (3, "F")])
+        conn.execute(
+            "CREATE TABLE admissions (hadm_id INT PRIMARY KEY, subject_id INT NOT NULL REFERENCES patients (subject_id), admission_type TEXT)"
+        )
+        conn.executemany("INSERT INTO admissions VALUES (?, ?, ?)", [(10, 1, "URGENT"), (11, 1, "ELECTIVE"), (12, 2, "URGENT"), (13, 3, "EW EMER.")])
+        conn.execute("CREATE TABLE chartevents (itemid INTEGER)")
+        conn.executemany("INSERT INTO chartevents VALUES (?)", [(i,) for i in range(MAX_CACHED_ROWS + 10)])
+        conn.execute("CREATE TABLE labevents (label TEXT, valuenum REAL, flag TEXT)")
+        conn.executemany("INSERT INTO labevents VALUES (?, ?, ?)", [(f"lab {i}", i / 10, "abnormal") for i in range(100)])
+    return path
+
+
+class ScriptedUser:
+    def __init__(self, opening):
+        self.opening = opening
+        self.calls = 0
+
+    def reset(self, instruction):
+        self.calls += 1
+        return self.opening
+
+    async def areset(self, instruction):
+        return self.reset(instruction)
+
+
+class FakeEnv:
+    """Stands in for an Env: one task, users whose openings follow `openings`, a fixed tool observation and reward 1."""
+
+    tools_info, rule, schema_digest = [], "", None
+
+    def __init__(self, openings=(), gold_sql=None, observation="[('F',)]"):
+        self.task = Task(task_id="0", instruction="find the gender", gold_sql=gold_sql)
+        self.tasks = [self.task]
+        self.openings = list(openings)
+        self.observation = observation
+        self.users = []
+        self.actions = []
+        self.started = None
+
+    def spawn_user(self):
+        user = ScriptedUser(self.openings[len(self.users)])
+        self.users.append(user)
+        return user
+
+    def reset(self, task_index=None, user=None, initial_observation=None):
+        self.actions = []
+        self.started = (user, initial_observation)
+        return initial_observation
+
+    async def areset(self, task_index=None, user=None, initial_observation=None):
+        return self.reset(task_index, user, initial_observation)
+
+    def invoke_tool(self, action):
+        return self.observation
+
+    def get_user_cost(self):
+        return 0.0
+
+    def calculate_reward_sql(self):
+        return RewardInfo(reward=1.0, info={})
+
+
+@pytest.fixture
+def fake_env():
+    """Factory for FakeEnv."""
+    return FakeEnv
@@ -0,0 +1,95 @@
+import json
+from types import SimpleNamespace
+
+from src.agents.context import ContextCompactor
+from src.agents.tool_calling_agent import ToolCallingAgent
+from src.types import EnvInfo, EnvResponse, RewardInfo
+from src.utils import estimate_tokens
+
+RESULT = "\n".join(f"('value {i}',)" for i in range(150))
+
+
+def tool_call(i, query="SELECT 1"):
+    return {"id": f"c{i}", "type": "function", "function": {"name": "sql_db_query", "arguments": json.dumps({"query": query})}}
+
+
+def episode(num_calls=5):
+    messages = [{"role": "system", "content": "rules"}, {"role": "user", "content": "which values?"}]
+    for i in range(num_calls):
+        messages.append({"role": "assistant", "content": None, "tool_calls": [tool_call(i)]})
+        messages.append({"role": "tool", "tool_call_id": f"c{i}", "name": "sql_db_query", "content": RESULT})
+    return messages
+
+
+def tool_contents(messages):
+    return [m["content"] for m in messages if m["role"] == "tool"]
+
+
+def test_no_budget_leaves_messages_untouched():
+    messages = episode()
+    assert ContextCompactor(None).compact(messages) is messages
+
+
+def test_prompt_within_budget_is_untouched():
+    messages = episode()
+    assert ContextCompactor(estimate_tokens(messages)).compact(messages) is messages
+
+
+def test_stale_observations_are_truncated_only_until_the_prompt_fits():
+    messages = episode()
+    budget = estimate_tokens(messages) - 100
+    compacted = ContextCompactor(budget, keep_recent=3).compact(messages)
+    contents = tool_contents(compacted)
+    assert estimate_tokens(compacted) <= budget
+    # Truncating the oldest observation is enough, so the next one stays verbatim.
+    assert contents[0].startswith("('value 0',)") and "more characters of this earlier sql_db_query result omitted" in contents[0]
+    assert contents[1:] == [RESULT] * 4
+    assert tool_contents(messages) == [RESULT] * 5
+
+
+def test_stale_observations_are_stubbed_when_truncation_is_not_enough():
+    messages = episode()
+    compacted = ContextCompactor(1, keep_recent=3).compact(messages)
+    contents = tool_contents(compacted)
+    assert contents[:2] == ["[Earlier sql_db_query result omitted to save context; call the tool again if you need it]"] * 2
+    # Recent observations and every non-tool turn stay verbatim.
+    assert contents[2:] == [RESULT] * 3
+    assert [m for m in compacted if m["role"] != "tool"] == [m for m in messages if m["role"] != "tool"]
+    assert [m["tool_call_id"] for m in compacted if m["role"] == "tool"] == [f"c{i}" for i in range(5)]
+
+
+def completion(message):
+    return SimpleNamespace(
+        _hidden_params={"response_cost": 0.0},
+        usage=None,
+        choices=[SimpleNamespace(message=SimpleNamespace(model_dump=lambda: dict(message)))],
+    )
+
+
+def test_prompt_tokens_has_one_entry_per_completion(fake_env):
+    class Env(fake_env):
+        def reset(self, task_index=None, user=None, initial_observation=None):
+            super().reset(task_index, user, initial_observation)
+            return EnvResponse(observation="which values?", reward=0.0, done=False, info=EnvInfo(task=self.task, reward_info=RewardInfo()))
+
+        def step(self, action):
+            self.actions.append(action)
+            done = action.name == "respond"
+            observation = "thanks ###END###" if done else RESULT
+            return EnvResponse(observation=observation, reward=1.0 if done else 0.0, done=done, info=EnvInfo(task=self.task, reward_info=RewardInfo()))
+
+    agent = ToolCallingAgent(tools_info=[], rule="", model="m", context_token_budget=1)
+    responses = iter([{"role": "assistant", "content": None, "tool_calls": [tool_call(i)]} for i in range(4)] + [{"role": "assistant", "content": "done"}])
+    prompts = []
+
+    def complete(messages):
+        prompts.append(messages)
+        return completion(next(responses))
+
+    agent.complete = complete
+    result = agent.run(Env(), task_index=0, user_samples=1)
+    assert result.info["prompt_tokens"] == [estimate_tokens(prompt) for prompt in prompts]
+    assert len(prompts) == 5
+    # The trajectory keeps every observation; only the prompts were compacted.
+    assert tool_contents(result.messages) == [RESULT] * 4
+    assert tool_contents(prompts[-1])[0].startswith("[Earlier sql_db_query result omitted")
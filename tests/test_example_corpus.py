@@ -0,0 +1,11 @@
+import os
+
+from src.envs.mimic_iv.tools.example_corpus import ExampleCorpus
+
+
+def test_example_corpus_is_built_once(tmp_path):
+    path = str(tmp_path / "cache" / "corpus.sqlite")
+    corpus = ExampleCorpus(path)
+    assert len(corpus) == len(corpus.column("id")) > 0
+    assert os.listdir(tmp_path / "cache") == ["corpus.sqlite"]
+    assert ExampleCorpus(path).get([0]) == corpus.get([0])
@@ -0,0 +1,76 @@
+import pytest
+from litellm import ModelResponse
+
+from src import llm
+
+
+class FakeProvider:
+    """Answers with scripted contents; a content of None fails like a provider error."""
+
+    def __init__(self, contents):
+        self.contents = list(contents)
+        self.prompts = []
+
+    def __call__(self, **kwargs):
+        self.prompts.append([m["content"] for m in kwargs["messages"]])
+        content = self.contents.pop(0)
+        if content is None:
+            raise RuntimeError("503")
+        return ModelResponse(choices=[{"message": {"role": "assistant", "content": content}}])
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(llm.time, "sleep", delays.append)
+    llm.configure_rate_limits(max_retries=3)
+    yield delays
+    llm.configure_response_cache(None)
+    llm.configure_rate_limits()
+
+
+def no_sql(messages):
+    """Like LLMUser.accept_message: a reply with SQL is rejected after a correction is added to the prompt."""
+    def accept(res):
+        content = res.choices[0].message.content
+        if "SELECT" in content:
+            messages.append({"role": "user", "content": "act like a user"})
+            raise ValueError("agent-like reply")
+        messages.append({"role": "assistant", "content": content})
+        return content
+    return accept
+
+
+def converse(monkeypatch, provider):
+    monkeypatch.setattr(llm, "completion", provider)
+    messages = [{"role": "user", "content": "hi"}]
+    reply = llm.complete(accept=no_sql(messages), model="m", messages=messages)
+    return reply, messages
+
+
+def test_rejected_response_is_retried_without_backoff(monkeypatch, sleeps):
+    provider = FakeProvider(["SELECT 1", "hello"])
+    reply, messages = converse(monkeypatch, provider)
+    assert reply == "hello"
+    assert provider.prompts == [["hi"], ["hi", "act like a user"]]
+    assert not any(sleeps)
+
+
+def test_provider_error_backs_off(monkeypatch, sleeps):
+    monkeypatch.setattr(llm, "backoff_delay", lambda attempt: 1.5)
+    provider = FakeProvider([None, "hello"])
+    assert converse(monkeypatch, provider)[0] == "hello"
+    assert 1.5 in sleeps
+
+
+def test_cached_replay_repeats_the_correction(monkeypatch, sleeps, tmp_path):
+    llm.configure_response_cache(str(tmp_path / "cache.sqlite"))
+    original = converse(monkeypatch, FakeProvider(["SELECT 1", "hello"]))
+    offline = FakeProvider([])
+    assert converse(monkeypatch, offline) == original
+    assert offline.prompts == []
+
+
+def test_rejections_exhaust_the_retry_budget(monkeypatch, sleeps):
+    with pytest.raises(ValueError):
+        converse(monkeypatch, FakeProvider(["SELECT 1"] * 4))
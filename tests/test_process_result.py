@@ -0,0 +1,52 @@
+import random
+
+import pytest
+
+from src.utils import MAX_COMPARED_ROWS, _process_rows, _process_rows_columnar, process_result
+
+VALUES = [0, 1, -1, 2, 0.0, -0.0, 1.0, 0.5, 1.0005, 1.0004, -2.5, 1e20, float("nan"), float("inf"),
+          True, False, None, "", "a", "B", "1", "1.0", "-0.0", "0.1234", "nan", "x y"]
+
+
+def random_rows(rng, n_rows, width):
+    # Draw each column from a small pool so that values repeat, as in real query results.
+    pools = [rng.sample(VALUES, rng.randint(1, 8)) for _ in range(width)]
+    return [tuple(rng.choice(pool) for pool in pools) for _ in range(n_rows)]
+
+
+def test_columnar_matches_row_wise_on_random_results():
+    rng = random.Random(0)
+    for _ in range(3000):
+        rows = random_rows(rng, rng.choice([1, 2, 5, 50, MAX_COMPARED_ROWS, MAX_COMPARED_ROWS + 1, 300]), rng.randint(1, 4))
+        assert _process_rows_columnar(rows) == _process_rows(rows)
+        assert process_result(rows) == _process_rows(rows)
+
+
+def test_negative_zero_keeps_its_sign():
+    rows = [(0.0,), (-0.0,), (0,), (False,)] * 40
+    assert _process_rows_columnar(rows) == _process_rows(rows)
+    assert ["-0.0"] in _process_rows_columnar(rows)
+
+
+@pytest.mark.parametrize("rows", [
+    [(True, 1), (1, True), (1.0, False), (0, 0.0)],
+    [(True,), (1,), (2,), (False,)] * 60,
+])
+def test_bool_and_int_share_their_string(rows):
+    assert _process_rows_columnar(rows) == _process_rows(rows)
+
+
+@pytest.mark.parametrize("rows", [
+    [(1, 2), (3,), (4, 5, 6)],
+    [(1,), ()],
+    [(), ()],
+])
+def test_ragged_rows_fall_back_to_row_wise(rows):
+    assert _process_rows_columnar(rows) == _process_rows(rows)
+    assert process_result(rows) == _process_rows(rows)
+
+
+def test_text_and_unhashable_results():
+    assert process_result("[(1, 'a'), (0.5, None)]") == _process_rows([(1, "a"), (0.5, None)])
+    assert process_result("no rows") == "no rows"
+    assert process_result([[[1], 2], [[0], 3]]) == _process_rows([[[1], 2], [[0], 3]])
@@ -0,0 +1,50 @@
+import sqlite3
+
+from sqlalchemy import create_engine
+
+from src.envs.mimic_iv.tools.value_substring_search import ValueSubstringSearch
+from src.envs.query_cache import QueryCache, configure_query_cache, get_query_cache, normalize_sql
+
+
+def test_line_comment_does_not_merge_queries(db_path):
+    filtered = "SELECT * FROM patients -- c\nWHERE gender = 'F'"
+    commented_out = "SELECT * FROM patients -- c WHERE gender = 'F'"
+    with sqlite3.connect(db_path) as conn:
+        assert len(conn.execute(filtered).fetchall()) != len(conn.execute(commented_out).fetchall())
+    assert normalize_sql(filtered) != normalize_sql(commented_out)
+    assert QueryCache.make_key(db_path, "rows", filtered) != QueryCache.make_key(db_path, "rows", commented_out)
+
+
+def test_literals_are_preserved():
+    assert normalize_sql("SELECT * FROM patients WHERE gender = 'F  '") != normalize_sql("SELECT * FROM patients WHERE gender = 'F '")
+    assert "'a  -- b'" in normalize_sql("SELECT 'a  -- b';")
+
+
+def test_surrounding_whitespace_and_semicolon_are_ignored(db_path):
+    assert normalize_sql("  SELECT 1;\n") == normalize_sql("SELECT 1")
+    assert QueryCache.make_key(db_path, "rows", "SELECT 1;") == QueryCache.make_key(db_path, "rows", "SELECT 1")
+
+
+def test_lru_eviction():
+    cache = QueryCache(max_entries=2)
+    keys = [("db", "fp", "ns", f"q{i}", ()) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, i)
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[2]) == 2
+
+
+def test_substring_search_caches_index_and_scan_answers_apart(db_path):
+    class Index:
+        def has_column(self, table, column):
+            return True
+
+        def search(self, table, column, value, k=100):
+            return ["from index"]
+
+    configure_query_cache(4096)
+    get_query_cache().clear()
+    engine = create_engine(f"sqlite:///{db_path}")
+    assert "from index" in ValueSubstringSearch(engine=engine, value_index=Index()).invoke("patients", "gender", "F")
+    assert ValueSubstringSearch(engine=engine).invoke("patients", "gender", "F") == "Values in patients.gender containing 'F': ['F']."
+    get_query_cache().clear()
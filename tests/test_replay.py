@@ -0,0 +1,69 @@
+from argparse import Namespace
+
+import pytest
+
+import replay
+from src.checkpoint import CheckpointWriter, checkpoint_eval_mode
+from src.types import CostInfo, EnvRunResult
+
+
+def replay_record(monkeypatch, fake_env, gold_sql, reward, user_reply):
+    def get_env(**kwargs):
+        assert kwargs["instruction_index"] == "bm25"
+        return fake_env(gold_sql=gold_sql)
+
+    monkeypatch.setattr(replay, "get_env", get_env)
+    messages = [
+        {"role": "system", "content": "rules"},
+        {"role": "user", "content": "gender of patient 1?"},
+        {"role": "assistant", "content": None, "tool_calls": [{"id": "c0", "type": "function", "function": {"name": "sql_db_query", "arguments": '{"query": "SELECT gender FROM patients"}'}}]},
+        {"role": "tool", "tool_call_id": "c0", "name": "sql_db_query", "content": "[('F',)]"},
+        {"role": "assistant", "content": "It is F"},
+        {"role": "user", "content": user_reply},
+    ]
+    record = EnvRunResult(task_idx=0, trial=1, reward=reward, info={}, messages=messages, cost=CostInfo()).model_dump()
+    config = Namespace(env="mimic_iv", query_timeout=30.0, query_max_steps=None, instruction_index="bm25", skip_tools=False)
+    return replay.replay_episode(config, "valid", record)
+
+
+def test_finished_episode_is_rescored(monkeypatch, fake_env):
+    record, changed = replay_record(monkeypatch, fake_env, "SELECT gender FROM patients", 0.0, "thanks ###END###")
+    assert record["reward"] == 1.0
+    assert record["info"]["replay"] == {"original_reward": 0.0, "changed_observations": 0}
+
+
+def test_unfinished_episode_scores_zero(monkeypatch, fake_env):
+    record, _ = replay_record(monkeypatch, fake_env, "SELECT gender FROM patients", 1.0, "and the age?")
+    assert record["reward"] == 0.0
+
+
+@pytest.mark.parametrize("user_reply", ["thanks ###END###", "and the age?"])
+def test_episode_without_gold_answer_keeps_its_reward(monkeypatch, fake_env, user_reply):
+    record, _ = replay_record(monkeypatch, fake_env, None, None, user_reply)
+    assert record["reward"] is None
+    assert record["info"]["replay"]["original_reward"] is None
+
+
+def test_checkpoint_eval_mode():
+    assert checkpoint_eval_mode("results/run_0514185931_test.json") == "test"
+    assert checkpoint_eval_mode("results/run_0514190531_valid.jsonl") == "valid"
+
+
+@pytest.mark.parametrize("num_trials", [1, 2])
+def test_checkpoint_with_fewer_than_four_trials_reports_metrics(monkeypatch, fake_env, tmp_path, capsys, num_trials):
+    monkeypatch.setattr(replay, "get_env", lambda **kwargs: fake_env(gold_sql="SELECT gender FROM patients"))
+    messages = [
+        {"role": "user", "content": "gender of patient 1?"},
+        {"role": "assistant", "content": "It is F"},
+        {"role": "user", "content": "thanks ###END###"},
+    ]
+    ckpt_path = str(tmp_path / "run_valid.jsonl")
+    with CheckpointWriter(ckpt_path) as checkpoint:
+        for trial in range(1, num_trials + 1):
+            checkpoint.append(EnvRunResult(task_idx=0, trial=trial, reward=0.0, info={}, messages=messages, cost=CostInfo()))
+    config = Namespace(
+        env="mimic_iv", eval_mode=None, query_timeout=30.0, query_max_steps=None, instruction_index="flat",
+        skip_tools=False, workers=1, max_concurrency=1, output_dir=None,
+    )
+    assert replay.replay_checkpoint(config, ckpt_path) == str(tmp_path / "run_valid_replay.json")
+    assert f"Pass@{num_trials}: 100.0 (%)" in capsys.readouterr().out
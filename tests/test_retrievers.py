@@ -0,0 +1,46 @@
+from src.envs.mimic_iv.tools.retrievers import BM25Retriever, HybridRetriever, Retriever
+
+
+class Corpus:
+    def __init__(self, questions, labels):
+        self.columns = {"question": questions, "label": labels}
+
+    def column(self, name):
+        return self.columns[name]
+
+
+class FixedRanking(Retriever):
+    def __init__(self, ranking):
+        self.ranking = ranking
+
+    def search_many(self, queries, k):
+        return [self.ranking[:k] for _ in queries]
+
+
+def hybrid(labels, dense, lexical):
+    corpus = Corpus([f"question {i}" for i in range(len(labels))], labels)
+    return HybridRetriever(corpus, dense=FixedRanking(dense), lexical=FixedRanking(lexical))
+
+
+def test_bm25_ranking():
+    retriever = BM25Retriever(["heart rate of patient", "blood pressure of patient", "heart rate heart rate trend", "sodium level"])
+    # More occurrences outweigh the longer document.
+    assert retriever.search_many(["Heart rate?", "sodium"], 2)[0] == [2, 0]
+    assert retriever.search_many(["sodium"], 1) == [[3]]
+    assert retriever.search_many(["heart rate"], 0) == [[]]
+
+
+def test_reciprocal_rank_fusion():
+    labels = [f"SELECT a FROM t{i}" for i in range(4)]
+    # 1 is near the top of both rankings; 3 is found by the lexical ranking only.
+    assert hybrid(labels, dense=[0, 1, 2], lexical=[1, 3]).search_many(["q"], 4) == [[1, 0, 3, 2]]
+
+
+def test_mmr_drops_near_duplicate_patterns():
+    labels = [
+        "SELECT gender FROM patients WHERE subject_id = 1",
+        "SELECT gender FROM patients WHERE subject_id = 2",
+        "SELECT COUNT(*) FROM admissions JOIN icustays ON admissions.hadm_id = icustays.hadm_id",
+    ]
+    # 1 ranks second in both rankings but differs from 0 only in its literal.
+    assert hybrid(labels, dense=[0, 1, 2], lexical=[0, 1, 2]).search_many(["q"], 2) == [[0, 2]]
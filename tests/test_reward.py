@@ -0,0 +1,50 @@
+from contextlib import contextmanager
+
+import pytest
+
+from src.envs import base
+from src.envs.base import Env
+from src.envs.query_cache import configure_query_cache, get_query_cache
+from src.types import Action, Task
+
+
+@pytest.fixture
+def executions(monkeypatch):
+    """Counts the queries calculate_reward_sql actually executes."""
+    budget = base.sql_query_budget
+    counter = []
+
+    @contextmanager
+    def counting_budget(*args, **kwargs):
+        counter.append(1)
+        with budget(*args, **kwargs):
+            yield
+
+    monkeypatch.setattr(base, "sql_query_budget", counting_budget)
+    monkeypatch.setattr(base, "load_user", lambda **kwargs: None)
+    configure_query_cache(4096)
+    get_query_cache().clear()
+    yield counter
+    get_query_cache().clear()
+
+
+def make_env(db_path, queries, query_max_steps=None):
+    task = Task(task_id="0", instruction="", gold_sql="SELECT gender FROM patients WHERE subject_id = 2", gold_answer=[["M"]])
+    env = Env(tools=[], tasks=[task], user_strategy="llm", user_model="m", db_path=db_path, task_index=0, query_max_steps=query_max_steps)
+    env.actions = [Action(name="sql_db_query", kwargs={"query": query}) for query in queries]
+    return env
+
+
+def test_repeated_query_is_executed_once(db_path, executions):
+    query = "SELECT gender FROM patients WHERE subject_id = 1"
+    assert make_env(db_path, [query, query]).calculate_reward_sql().reward == 0.0
+    assert make_env(db_path, [query]).calculate_reward_sql().reward == 0.0
+    assert len(executions) == 1
+
+
+@pytest.mark.parametrize("query", ["SELECT missing FROM patients", "SELECT COUNT(*) FROM chartevents a, chartevents b"])
+def test_failed_query_is_not_cached(db_path, executions, query):
+    for _ in range(2):
+        assert make_env(db_path, [query], query_max_steps=10000).calculate_reward_sql().reward == 0.0
+    assert len(executions) == 2
+    assert get_query_cache().get(get_query_cache().make_key(db_path, "reward", query)) is None
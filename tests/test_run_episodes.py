@@ -0,0 +1,86 @@
+from argparse import Namespace
+
+import pytest
+
+import run
+from src.checkpoint import CheckpointWriter, compact_checkpoint, load_checkpoint
+from src import telemetry
+from src.types import AgentRunResult, CostInfo, EnvRunResult
+
+
+class SolvingAgent:
+    """Solves every episode after one tool call."""
+
+    def run(self, env, task_index):
+        with telemetry.span("tool", "sql_db_query"):
+            pass
+        return AgentRunResult(reward=1.0, messages=[], agent_cost=0.0, info={})
+
+    async def arun(self, env, task_index):
+        return self.run(env, task_index)
+
+
+class FailingAgent:
+    """Every episode fails the way an LLM call out of retries does."""
+
+    def __init__(self):
+        self.attempts = 0
+
+    def run(self, env, task_index):
+        self.attempts += 1
+        raise RuntimeError("rate limited")
+
+    async def arun(self, env, task_index):
+        return self.run(env, task_index)
+
+
+@pytest.fixture
+def agent(monkeypatch, fake_env):
+    agent = FailingAgent()
+    monkeypatch.setattr(run, "get_agent", lambda **kwargs: agent)
+    monkeypatch.setattr(run, "make_env", lambda config, task_index=None: fake_env())
+    monkeypatch.setattr(run, "backoff_delay", lambda attempt: 0.0)
+    return agent
+
+
+def make_config(async_mode):
+    return Namespace(
+        model="m", temperature=0.0, agent_strategy="tool-calling", context_token_budget=None, eval_mode="valid",
+        simulation_retry=10, episode_errors=3, async_mode=async_mode, max_concurrency=2, tool_workers=1,
+    )
+
+
+@pytest.mark.parametrize("async_mode", [False, True])
+def test_repeated_errors_end_the_episode(agent, fake_env, tmp_path, async_mode):
+    ckpt_path = str(tmp_path / "run.jsonl")
+    with CheckpointWriter(ckpt_path) as checkpoint:
+        results = run.run_episodes(make_config(async_mode), fake_env(), [0, 1], [1, 1], checkpoint)
+
+    assert agent.attempts == 6
+    assert [r.info["error"] for r in results] == ["rate limited", "rate limited"]
+    assert sorted(r["task_idx"] for r in load_checkpoint(ckpt_path)) == [0, 1]
+
+
+@pytest.mark.parametrize("async_mode", [False, True])
+def test_spans_are_saved_with_each_result(monkeypatch, fake_env, tmp_path, async_mode):
+    monkeypatch.setattr(run, "get_agent", lambda **kwargs: SolvingAgent())
+    monkeypatch.setattr(run, "make_env", lambda config, task_index=None: fake_env())
+    ckpt_path = str(tmp_path / "run.jsonl")
+    with CheckpointWriter(ckpt_path) as checkpoint:
+        results = run.run_episodes(make_config(async_mode), fake_env(), [0], [1], checkpoint)
+
+    labels = ["make_env", "tool:sql_db_query", "episode"]
+    assert [telemetry.span_label(span) for span in results[0].spans] == labels
+    assert [telemetry.span_label(span) for span in load_checkpoint(ckpt_path)[0]["spans"]] == labels
+
+
+def test_compaction_keeps_one_record_per_episode(tmp_path):
+    ckpt_path = str(tmp_path / "run.jsonl")
+    with CheckpointWriter(ckpt_path) as checkpoint:
+        checkpoint.append(EnvRunResult(task_idx=0, trial=1, reward=0.0, info={"error": "x"}, messages=[], cost=CostInfo()))
+        checkpoint.append(EnvRunResult(task_idx=1, trial=1, reward=0.0, info={"error": "x"}, messages=[], cost=CostInfo()))
+        checkpoint.append(EnvRunResult(task_idx=0, trial=1, reward=1.0, info={}, messages=[], cost=CostInfo()))
+        checkpoint.append(EnvRunResult(task_idx=0, trial=1, reward=0.0, info={"error": "y"}, messages=[], cost=CostInfo()))
+        checkpoint.append(EnvRunResult(task_idx=1, trial=1, reward=0.0, info={"error": "y"}, messages=[], cost=CostInfo()))
+    records = load_checkpoint(compact_checkpoint(ckpt_path))
+    assert [(r["task_idx"], r["reward"], r["info"].get("error")) for r in records] == [(0, 1.0, None), (1, 0.0, "y")]
@@ -0,0 +1,33 @@
+import os
+import time
+from argparse import Namespace
+
+import pytest
+
+import run
+from src.checkpoint import CheckpointWriter, load_checkpoint, shard_checkpoint_path
+from src.types import CostInfo, EnvRunResult
+
+
+def fake_shard(config, shard, idx_to_run, trials, ckpt_path):
+    """Stands in for run.run_shard: shard 0 fails at once, the others finish their episodes later."""
+    if shard == 0:
+        raise RuntimeError("worker failed")
+    time.sleep(1.0)
+    results = [EnvRunResult(task_idx=i, trial=t, reward=1.0, info={}, messages=[], cost=CostInfo()) for i, t in zip(idx_to_run, trials)]
+    with CheckpointWriter(shard_checkpoint_path(ckpt_path, shard)) as checkpoint:
+        for result in results:
+            checkpoint.append(result)
+    return [r.model_dump() for r in results], {}
+
+
+def test_failed_shard_keeps_other_shards_results(tmp_path):
+    ckpt_path = str(tmp_path / "run.jsonl")
+    idx_to_run, trials = [0, 1, 2, 0, 1, 2], [1, 1, 1, 2, 2, 2]
+    with pytest.raises(RuntimeError, match="worker failed"):
+        run.run_sharded(Namespace(workers=3), idx_to_run, trials, ckpt_path, shard_runner=fake_shard)
+
+    merged = {(r["task_idx"], r["trial"]) for r in load_checkpoint(ckpt_path)}
+    # Shard 0 got (0, 1) and (0, 2); shards 1 and 2 finished after shard 0 failed and were still merged.
+    assert merged == {(1, 1), (2, 1), (1, 2), (2, 2)}
+    assert not [name for name in os.listdir(tmp_path) if ".shard" in name]
@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+
+from src.agents.tool_calling_agent import ToolCallingAgent
+
+
+def sample(env, async_mode):
+    agent = ToolCallingAgent(tools_info=[], rule="", model="m")
+    if async_mode:
+        return asyncio.run(agent.asample_reset(env, 0, 10))
+    return agent.sample_reset(env, 0, 10)
+
+
+@pytest.mark.parametrize("async_mode", [False, True])
+def test_unanimous_first_wave_stops_early(fake_env, async_mode):
+    env = fake_env(["hi"] * 10)
+    assert sample(env, async_mode) == "hi"
+    assert len(env.users) == 6
+    assert all(user.calls == 1 for user in env.users)
+
+
+@pytest.mark.parametrize("async_mode", [False, True])
+def test_disagreement_samples_only_what_can_reach_a_majority(fake_env, async_mode):
+    env = fake_env(["a", "a", "a", "a", "b", "b", "a", "a", "b", "b"])
+    assert sample(env, async_mode) == "a"
+    # The first wave of 6 has 4 "a"; 2 more reach the majority of 6.
+    assert len(env.users) == 8
+
+
+@pytest.mark.parametrize("async_mode", [False, True])
+def test_no_majority_samples_the_whole_budget(fake_env, async_mode):
+    env = fake_env(["a", "b", "c", "d", "e", "f", "g", "h", "i", "j"])
+    sample(env, async_mode)
+    assert len(env.users) == 10
@@ -0,0 +1,52 @@
+import pytest
+from sqlalchemy import create_engine
+
+from src.envs.mimic_iv.tools.sql_db_list_tables import SqlDbListTables
+from src.envs.mimic_iv.tools.sql_db_schema import SqlDbSchema
+
+ADMISSIONS_SCHEMA = """CREATE TABLE {name} (
+\thadm_id INTEGER,
+\tsubject_id INTEGER NOT NULL,
+\tadmission_type TEXT,
+\tPRIMARY KEY (hadm_id),
+\tFOREIGN KEY (subject_id) REFERENCES patients (subject_id)
+)
+/*
+3 rows from {name} table:
+hadm_id\tsubject_id\tadmission_type
+10\t1\tURGENT
+11\t1\tELECTIVE
+12\t2\tURGENT
+*/"""
+
+PATIENTS_SCHEMA = """CREATE TABLE patients (
+\tsubject_id INTEGER,
+\tgender TEXT,
+\tPRIMARY KEY (subject_id)
+)
+/*
+3 rows from patients table:
+subject_id\tgender
+1\tF
+2\tM
+3\tF
+*/"""
+
+
+@pytest.fixture
+def engine(db_path):
+    return create_engine(f"sqlite:///{db_path}")
+
+
+def test_list_tables(engine):
+    assert SqlDbListTables(engine=engine).invoke() == "admissions, chartevents, labevents, patients"
+
+
+@pytest.mark.parametrize("name", ["admissions", "ADMISSIONS"])
+def test_schema_of_one_table(engine, name):
+    assert SqlDbSchema(engine=engine).invoke(name) == ADMISSIONS_SCHEMA.format(name=name)
+
+
+def test_schema_of_several_tables(engine):
+    expected = [ADMISSIONS_SCHEMA.format(name="admissions"), "Error: table_names {'prescriptions'} not found in database", PATIENTS_SCHEMA]
+    assert SqlDbSchema(engine=engine).invoke("admissions, prescriptions,patients") == "\n\n\n".join(expected)
@@ -0,0 +1,21 @@
+from src.envs.mimic_iv.tools.schema_digest import OMITTED_NOTE, build_schema_digest
+from src.utils import estimate_tokens
+
+
+def test_digest_lists_tables_keys_and_values(db_path):
+    digest = build_schema_digest(db_path).split("\n")
+    assert digest == [
+        "admissions(hadm_id INT PK, subject_id INT, admission_type TEXT ['ELECTIVE', 'EW EMER.', 'URGENT'])",
+        "  admissions.subject_id -> patients.subject_id",
+        "chartevents(itemid INTEGER)",
+        "labevents(label TEXT, valuenum REAL, flag TEXT ['abnormal'])",
+        "patients(subject_id INT PK, gender TEXT ['F', 'M'])",
+    ]
+
+
+def test_digest_drops_detail_to_fit_its_budget(db_path):
+    for budget in (70, 50, 40):
+        assert estimate_tokens([{"content": build_schema_digest(db_path, token_budget=budget)}]) <= budget
+    assert "'URGENT'" not in build_schema_digest(db_path, token_budget=70)
+    assert build_schema_digest(db_path, token_budget=50).startswith("admissions(hadm_id PK, subject_id, admission_type)")
+    assert build_schema_digest(db_path, token_budget=40).split("\n") == ["admissions(hadm_id PK, subject_id, admission_type)", OMITTED_NOTE]
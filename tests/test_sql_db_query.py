@@ -0,0 +1,42 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine
+
+from src.envs.query_cache import configure_query_cache, get_query_cache
+from src.envs.mimic_iv.tools.sql_db_query import MAX_CACHED_ROWS, SqlDbQuery
+from src.utils import QueryTimeoutError, sql_query_budget
+
+CROSS_JOIN = "SELECT COUNT(*) FROM chartevents a, chartevents b"
+
+
+@pytest.fixture
+def tool(db_path):
+    configure_query_cache(4096)
+    get_query_cache().clear()
+    yield SqlDbQuery(engine=create_engine(f"sqlite:///{db_path}"))
+    get_query_cache().clear()
+
+
+def test_small_complete_result_is_cached(tool):
+    tool.invoke("SELECT itemid FROM chartevents WHERE itemid < 5")
+    assert get_query_cache().stats()["entries"] == 2
+
+
+def test_large_result_is_not_cached(tool):
+    response = tool.invoke("SELECT itemid FROM chartevents", k=MAX_CACHED_ROWS + 10)
+    assert response.startswith("[(0,)")
+    assert get_query_cache().stats()["entries"] == 0
+
+
+def test_query_over_budget_is_reported_as_an_error(db_path):
+    tool = SqlDbQuery(engine=create_engine(f"sqlite:///{db_path}"), timeout=None, max_steps=10000)
+    assert tool.invoke(CROSS_JOIN).startswith("Error: Query cancelled because it exceeded the limit of 10000 execution steps.")
+
+
+def test_budget_is_lifted_after_the_query(db_path):
+    with sqlite3.connect(db_path) as conn:
+        with pytest.raises(QueryTimeoutError):
+            with sql_query_budget(conn, timeout=None, max_steps=10000):
+                conn.execute(CROSS_JOIN).fetchall()
+        assert conn.execute(CROSS_JOIN).fetchone() == ((MAX_CACHED_ROWS + 10) ** 2,)
@@ -0,0 +1,47 @@
+import contextvars
+import threading
+
+from src import telemetry
+
+
+def test_spans_are_recorded_per_stage_and_tool():
+    with telemetry.span("episode") as outside:
+        assert outside is None
+
+    with telemetry.recording() as recorder:
+        with telemetry.span("episode"):
+            with telemetry.span("agent_step"):
+                telemetry.annotate(llm_calls=1, prompt_tokens=100)
+
+            def tool_call():
+                with telemetry.span("tool", "sql_db_query"):
+                    telemetry.annotate(retries=2)
+
+            # A worker thread records into the episode only through a copy of its context.
+            thread = threading.Thread(target=contextvars.copy_context().run, args=(tool_call,))
+            thread.start()
+            thread.join()
+            telemetry.annotate(llm_calls=1)
+
+    spans = recorder.snapshot()
+    assert [telemetry.span_label(span) for span in spans] == ["agent_step", "tool:sql_db_query", "episode"]
+    agent_step, tool, episode = spans
+    assert agent_step["llm_calls"] == 1 and agent_step["prompt_tokens"] == 100
+    assert tool["retries"] == 2 and "llm_calls" not in tool
+    assert episode["llm_calls"] == 1
+    assert all(span["duration"] >= 0 for span in spans)
+
+
+def test_percentile_summary():
+    spans = [{"stage": "agent_step", "start": 0.0, "duration": float(d), "llm_calls": 1} for d in range(1, 11)]
+    spans += [{"stage": "tool", "name": "sql_db_query", "start": 0.0, "duration": 2.0}]
+    summary = telemetry.summarize_spans(spans)
+    assert summary["agent_step"]["count"] == 10
+    assert summary["agent_step"]["p50"] == 5.5
+    assert summary["agent_step"]["p95"] == 9.55
+    assert summary["agent_step"]["total"] == 55.0
+    assert summary["agent_step"]["llm_calls"] == 10
+    assert summary["tool:sql_db_query"]["p95"] == 2.0
+    table = telemetry.format_summary(spans).split("\n")
+    assert table[0].split()[:4] == ["stage", "count", "p50", "s"]
+    assert table[2].split()[:4] == ["tool:sql_db_query", "1", "2.0", "2.0"]
@@ -0,0 +1,44 @@
+import pytest
+from sqlalchemy import create_engine
+
+from src.envs.mimic_iv.tools import value_fuzzy_search
+from src.envs.mimic_iv.tools.value_fuzzy_search import ValueFuzzySearch
+
+
+@pytest.fixture
+def tool(db_path, monkeypatch):
+    monkeypatch.setattr(value_fuzzy_search, "_vocabularies", value_fuzzy_search.OrderedDict())
+    return ValueFuzzySearch(engine=create_engine(f"sqlite:///{db_path}"))
+
+
+def test_unindexed_column_is_read_up_to_the_limit(tool, monkeypatch):
+    monkeypatch.setattr(value_fuzzy_search, "MAX_VOCABULARY_VALUES", 10)
+    assert len(tool._vocabulary("labevents", "valuenum").values) == 10
+
+
+def test_least_recently_used_vocabulary_is_evicted(tool, monkeypatch):
+    monkeypatch.setattr(value_fuzzy_search, "MAX_VOCABULARIES", 2)
+    label = tool._vocabulary("labevents", "label")
+    tool._vocabulary("labevents", "valuenum")
+    assert tool._vocabulary("labevents", "label") is label
+    tool._vocabulary("labevents", "flag")
+    assert [key[3] for key in value_fuzzy_search._vocabularies] == ["label", "flag"]
+
+
+def test_indexed_column_is_read_up_to_the_limit(tool, monkeypatch):
+    class Index:
+        def has_column(self, table, column):
+            return True
+
+        def values(self, table, column, limit=-1):
+            return [f"value {i}" for i in range(100)][:limit]
+
+    monkeypatch.setattr(value_fuzzy_search, "MAX_VOCABULARY_VALUES", 10)
+    tool.value_index = Index()
+    assert len(tool._vocabulary("labevents", "label").values) == 10
+
+
+def test_build_locks_are_released(tool):
+    tool._vocabulary("labevents", "label")
+    assert "Error" in tool.invoke("labevents", "missing", "lab")
+    assert value_fuzzy_search._build_locks == {}
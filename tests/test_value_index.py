@@ -0,0 +1,33 @@
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from src.envs.mimic_iv.tools import value_index
+from src.envs.mimic_iv.tools.value_index import ValueIndex
+
+
+def test_index_is_built_in_place_and_read_from_any_thread(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE d_labitems (label TEXT, itemid INTEGER)")
+        conn.executemany("INSERT INTO d_labitems VALUES (?, ?)", [("Hemoglobin", 1), ("Hematocrit", 2), ("Sodium", 3)])
+    index = ValueIndex(db_path)
+    assert sorted(os.listdir(tmp_path)) == ["test.sqlite", "test.sqlite.value_index.sqlite"]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = list(executor.map(lambda value: index.search("d_labitems", "label", value), ["hem", "sod"]))
+    assert sorted(results[0]) == ["Hematocrit", "Hemoglobin"]
+    assert results[1] == ["Sodium"]
+
+
+
+def test_timestamp_and_high_cardinality_columns_are_not_indexed(tmp_path, monkeypatch):
+    monkeypatch.setattr(value_index, "MAX_INDEXED_VALUES", 5)
+    db_path = str(tmp_path / "test.sqlite")
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE labevents (label TEXT, charttime TEXT, stored TEXT, comments TEXT)")
+        conn.executemany(
+            "INSERT INTO labevents VALUES (?, ?, ?, ?)",
+            [("Sodium", f"2100-01-0{i} 08:00:00", f"2100-01-0{i}", f"note {i}") for i in range(1, 7)],
+        )
+    index = ValueIndex(db_path)
+    assert index.columns == {("labevents", "label")}